@@ -1,21 +1,172 @@
 import streamlit as st
-import google.generativeai as genai
+import streamlit.components.v1 as components
 import io
 import wave
 import struct
 import math
-import base64
 import random
-import requests
-import pyttsx3
 import tempfile
 import os
+import sys
+import json
+import html
+import hashlib
+import threading
+import queue
+import shutil
+import subprocess
+import mimetypes
+import uuid
+import mmap
+import atexit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+import sqlite3
+import re
+import time
+import heapq
+import codecs
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ElementTree
+from html.parser import HTMLParser
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from array import array
+from itertools import chain, count, cycle, repeat
+from functools import lru_cache
 from datetime import datetime
-from dataclasses import dataclass
-from enum import Enum
+from dataclasses import asdict, dataclass, field
+from enum import Enum, IntEnum
 
 st.set_page_config(page_title="EchoVerse Pro", page_icon="🎭", layout="wide")
 
+# Samples rendered per list-comprehension pass in the fallback synthesizer
+FALLBACK_BLOCK_SIZE = 8192
+
+# On-disk caches shared by every session of this process
+CACHE_DIR = os.environ.get('ECHOVERSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'echoverse_cache'))
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('ECHOVERSE_AUDIO_CACHE_MB', '512')) * 1024 * 1024
+# Other processes sharing CACHE_DIR add and touch files too; the budget is checked against the directory this often
+AUDIO_CACHE_RESCAN_SECONDS = 30
+REWRITE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+REWRITE_CACHE_MAX_ENTRIES = 5000
+HISTORY_SESSION_LIMIT = 20
+HISTORY_MAX_BYTES = int(os.environ.get('ECHOVERSE_HISTORY_MB', '1024')) * 1024 * 1024
+# Finished narrations and their segments, shared by every session and worker process using CACHE_DIR
+NARRATION_STORE_TTL_SECONDS = REWRITE_CACHE_TTL_SECONDS
+NARRATION_STORE_MAX_NARRATIONS = 2000
+NARRATION_STORE_MAX_SEGMENTS = 50000
+SQLITE_MAX_PARAMS = 500
+# Incremental blob I/O needs Python 3.11+; older versions copy history audio into SQLite in one piece
+SQLITE_BLOB_IO = hasattr(sqlite3.Connection, 'blobopen')
+
+# Long documents are split into chunks that are rewritten and narrated in parallel
+CHUNK_MAX_CHARS = 1200
+STREAM_FIRST_CHUNK_CHARS = 160
+PIPELINE_WORKERS = int(os.environ.get('ECHOVERSE_PIPELINE_WORKERS', '4'))
+# Chunks submitted ahead of the one being narrated; a long upload is read only as fast as it is narrated
+PIPELINE_MAX_IN_FLIGHT = 2 * PIPELINE_WORKERS
+# SAPI5 engines are independent per thread; the espeak driver shares global state
+ENGINE_POOL_WORKERS = int(os.environ.get('ECHOVERSE_ENGINE_WORKERS', '2' if sys.platform == 'win32' else '1'))
+# SAPI5 and NSSpeech keep settings per engine; espeak's voice, rate, volume and synth callback are process-wide
+ENGINE_PER_VOICE = sys.platform in ('win32', 'darwin')
+PROBE_TIMEOUT_SECONDS = 15
+# Background narration jobs, polled by the page while they run
+JOB_WORKERS = int(os.environ.get('ECHOVERSE_JOB_WORKERS', '4'))
+JOB_USER_LIMIT = 2
+JOB_POLL_SECONDS = 1.0
+# The live player only gets passages the listener could reach this soon; the rest stay off the page's media list
+LIVE_PLAYER_LOOKAHEAD_SECONDS = 120
+JOB_RETENTION_SECONDS = 3600
+ENCODE_BLOCK_SIZE = 64 * 1024
+# Server-side audio effects, rendered once per parameter set and cached next to the narration
+DSP_BLOCK_FRAMES = 64 * 1024
+DSP_NORMALIZE_PEAK = 10 ** (-1 / 20)
+DSP_SILENCE_THRESHOLD = 10 ** (-45 / 20)
+DSP_SILENCE_PAD_SECONDS = 0.05
+STRETCH_FRAME_SECONDS = 0.04
+STRETCH_TOLERANCE_SECONDS = 0.01
+STRETCH_SEARCH_STEP = 4
+WAV_HEADER_SIZE = 44
+DEFAULT_AUDIO_FORMAT = os.environ.get('ECHOVERSE_AUDIO_FORMAT', 'mp3')
+ESPEAK_TIMEOUT_SECONDS = 120
+# Audio is served by URL from Streamlit's own media endpoint, on the page's origin; set a public URL to
+# serve it from disk through a small range-capable HTTP server instead (e.g. behind the same reverse proxy)
+MEDIA_SERVER_URL = os.environ.get('ECHOVERSE_MEDIA_URL')
+# Streamlit's endpoint holds every file it serves in memory for as long as a session shows it, so large ones are refused
+STREAMLIT_MEDIA_MAX_BYTES = int(os.environ.get('ECHOVERSE_STREAMLIT_MEDIA_MB', '64')) * 1024 * 1024
+MEDIA_SERVER_BIND = os.environ.get('ECHOVERSE_MEDIA_BIND', '127.0.0.1')
+MEDIA_SERVER_PORT = int(os.environ.get('ECHOVERSE_MEDIA_PORT', '0'))
+MEDIA_PATH = re.compile(r'/([a-z]+)/([A-Za-z0-9_-]+\.[a-z0-9]+)')
+BYTE_RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+# Download names come from the app itself; anything else could smuggle header text into Content-Disposition
+DOWNLOAD_NAME = re.compile(r'[A-Za-z0-9_.-]{1,128}')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_BREAK = re.compile(r'(?:(?<=[.!?…])|(?<=[.!?…]["\')\]]))\s+')
+# Stage timings are exposed at /metrics on a loopback-only listener; set a path to also log every event as JSON lines
+METRICS_BIND = os.environ.get('ECHOVERSE_METRICS_BIND', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('ECHOVERSE_METRICS_PORT', '0'))
+METRICS_JSONL_PATH = os.environ.get('ECHOVERSE_METRICS_JSONL')
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+# api_keys.txt is parsed once and re-read only when it changes on disk
+API_KEYS_PATH = os.environ.get('ECHOVERSE_API_KEYS', 'api_keys.txt')
+SETTINGS_CHECK_SECONDS = 1.0
+
+# Client-side limiter for Gemini calls, shared by every session in the process
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get('ECHOVERSE_GEMINI_RPM', '15'))
+GEMINI_BURST = 5
+GEMINI_MAX_RETRIES = 4
+GEMINI_BACKOFF_BASE_SECONDS = 1.0
+GEMINI_BACKOFF_MAX_SECONDS = 30.0
+GEMINI_MAX_WAIT_SECONDS = float(os.environ.get('ECHOVERSE_GEMINI_MAX_WAIT', '90'))
+GEMINI_BREAKER_THRESHOLD = 5
+GEMINI_BREAKER_COOLDOWN_SECONDS = 30.0
+GEMINI_RETRYABLE_ERRORS = ("rate_limit", "quota", "unavailable")
+# Shown with a narration when some of its passages fell back to the local rewrite, by error category
+REWRITE_FALLBACK_MESSAGES = {
+    "no_api_key": "⚠️ No Gemini API key is configured. Using fallback rewrite.",
+    "auth": "❌ Invalid Gemini API key. Please check your api_keys.txt file.",
+    "quota": "⚠️ Gemini API quota exceeded. Using fallback rewrite.",
+    "rate_limit": "⚠️ Gemini API rate limit reached. Using fallback rewrite.",
+    "throttled": "⚠️ Gemini is busy or temporarily unavailable. Using fallback rewrite.",
+    "unavailable": "⚠️ Gemini is busy or temporarily unavailable. Using fallback rewrite.",
+    "other": "❌ Gemini rewrite failed, see the server log. Using fallback rewrite.",
+}
+RETRY_DELAY = re.compile(r'(?:retry in |retry_delay\s*\{\s*seconds:\s*)(\d+(?:\.\d+)?)', re.IGNORECASE)
+# Several (text, tone) rewrites can share one structured Gemini request
+REWRITE_BATCH_MAX_ITEMS = 10
+REWRITE_BATCH_MAX_CHARS = 8000
+# Uploads are decoded and split into paragraphs a block at a time
+UPLOAD_TYPES = ['txt', 'md', 'markdown', 'epub']
+INGEST_BLOCK_SIZE = 64 * 1024
+# Text without blank lines (paragraphs on single lines, say) is let go at a line or sentence break past this length
+INGEST_MAX_PARAGRAPH_CHARS = 4 * CHUNK_MAX_CHARS
+# Uploads are never held whole: jobs, history and the tone comparison only keep their opening paragraphs
+UPLOAD_PREVIEW_CHARS = 3000
+TEXT_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+MARKDOWN_MARKUP = re.compile(r'^\s{0,3}(?:#{1,6}\s+|>\s?|[-*+]\s+|\d+[.)]\s+)|^\s*(?:[-*_]\s*){3,}$|^\s*```.*$|!\[[^\]]*\]\([^)]*\)|\[([^\]]*)\]\([^)]*\)|</?[A-Za-z][\w:-]*(?:\s[^<>\n]*)?/?>|[*_`~]+', re.MULTILINE)
+EPUB_BLOCK_TAGS = {'p', 'div', 'br', 'li', 'blockquote', 'section', 'article', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+EPUB_SKIP_TAGS = {'head', 'script', 'style', 'nav'}
+
+# Word timing estimates inside a chunk: extra weight, in characters, for the pause after punctuation
+SENTENCE_END = re.compile(r'[.!?…]["\')\]]*$')
+CLAUSE_END = re.compile(r'[,;:—–]["\')\]]*$')
+SENTENCE_PAUSE_WEIGHT = 6
+CLAUSE_PAUSE_WEIGHT = 3
+PLAYER_TEXT_HEIGHT = 420
+
+REWRITE_MODEL = 'gemini-1.5-flash'
+REWRITE_TEMPERATURE = 0.1
+
 class Tone(Enum):
     DRAMATIC = "Dramatic"
     CALM = "Calm"
@@ -31,6 +182,96 @@ class Voice(Enum):
     FEMALE_ALTO = "Female Alto"
     FEMALE_MATURE = "Female Mature"
 
+# Voice configuration based on voice type
+VOICE_CONFIGS = {
+    Voice.MALE_DEEP: {"rate": 150, "volume": 0.9, "voice_id": 0},
+    Voice.MALE_MEDIUM: {"rate": 180, "volume": 0.8, "voice_id": 0},
+    Voice.MALE_YOUNG: {"rate": 200, "volume": 0.8, "voice_id": 0},
+    Voice.FEMALE_SOPRANO: {"rate": 220, "volume": 0.8, "voice_id": 1},
+    Voice.FEMALE_ALTO: {"rate": 190, "volume": 0.8, "voice_id": 1},
+    Voice.FEMALE_MATURE: {"rate": 170, "volume": 0.8, "voice_id": 1}
+}
+
+TONE_PROMPTS = {
+    Tone.DRAMATIC: "Make this text slightly more engaging and impactful while keeping the original content mostly unchanged:",
+    Tone.CALM: "Make this text slightly more peaceful and easy to read while preserving the original message:",
+    Tone.EXCITING: "Add subtle energy to this text while maintaining the original meaning:",
+    Tone.MYSTERIOUS: "Give this text a subtle mysterious feel while keeping the original content:",
+    Tone.ROMANTIC: "Add gentle warmth to this text while preserving the original meaning:"
+}
+
+REWRITE_BATCH_PROMPT = ("Rewrite the text of every item below according to that item's instruction. "
+                        "Reply with only a JSON object that maps each item id to its rewritten text.")
+
+TONE_FALLBACK_PREFIXES = {
+    Tone.DRAMATIC: "🎭 DRAMATICALLY: ",
+    Tone.CALM: "😌 CALMLY: ",
+    Tone.EXCITING: "⚡ EXCITINGLY: ",
+    Tone.MYSTERIOUS: "🔮 MYSTERIOUSLY: ",
+    Tone.ROMANTIC: "💕 ROMANTICALLY: "
+}
+
+# Spoken forms for the speech engine, all folded into one compiled pattern so a passage is scanned once
+ABBREVIATIONS = {
+    "Mr.": "Mister", "Mrs.": "Missus", "Ms.": "Miz", "Dr.": "Doctor", "Prof.": "Professor", "Jr.": "Junior",
+    "Sr.": "Senior", "Capt.": "Captain", "Col.": "Colonel", "Gen.": "General", "Lt.": "Lieutenant", "Sgt.": "Sergeant",
+    "Mt.": "Mount", "vs.": "versus", "etc.": "et cetera", "e.g.": "for example", "i.e.": "that is", "approx.": "approximately",
+    "Jan.": "January", "Feb.": "February", "Aug.": "August", "Sept.": "September", "Oct.": "October", "Nov.": "November", "Dec.": "December"
+}
+PRONUNCIATIONS = {"EchoVerse": "Echo Verse", "AI": "A I", "TTS": "T T S", "&": "and"}
+CURRENCIES = {"$": ("dollar", "dollars", "cent", "cents"), "£": ("pound", "pounds", "penny", "pence"), "€": ("euro", "euros", "cent", "cents")}
+NUMBER_ONES = ("zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen "
+               "sixteen seventeen eighteen nineteen").split()
+NUMBER_TENS = "_ _ twenty thirty forty fifty sixty seventy eighty ninety".split()
+NUMBER_SCALES = ("", "thousand", "million", "billion", "trillion")
+ORDINAL_WORDS = {"one": "first", "two": "second", "three": "third", "five": "fifth", "eight": "eighth", "nine": "ninth", "twelve": "twelfth"}
+NUMBER = r'(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?'
+# A standalone 1100-2099, or its decade (1990s); not part of a phone number, decimal, time or path, but ranges like 1999-2004 count
+YEAR = r"(?<![\w.,:/$£€])(?:(?<!\d-)|(?<=(?<!\d)(?:1[1-9]|20)\d\d-))(?:1[1-9]|20)\d\d(?:'?s\b)?(?![\w%:/]|[.,]\d|-(?!(?:1[1-9]|20)\d\d\b)\d)"
+EMOJI = '[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]'
+# (kind, pattern) in priority order; spoken_form() says each kind
+SPOKEN_FORM_RULES = [
+    ("prefix", "|".join(re.escape(prefix) for prefix in TONE_FALLBACK_PREFIXES.values())),
+    ("link", r'\[[^\]\n]*\]\([^)\n]*\)'),
+    ("markup", r'</?[A-Za-z][\w:-]*(?:\s[^<>\n]*)?/?>|[*_`~#]+'),
+    ("emoji", f'{EMOJI}+'),
+    ("money", f'[{re.escape("".join(CURRENCIES))}]{NUMBER}'),
+    ("time", r'\b\d{1,2}:\d{2}\b'),
+    ("ordinal", r'\b\d+(?:st|nd|rd|th)\b'),
+    ("percent", f'{NUMBER}%'),
+    ("year", YEAR),
+    ("number", NUMBER),
+    ("abbreviation", r'(?<![\w.])(?:' + "|".join(re.escape(word) for word in sorted(ABBREVIATIONS, key=len, reverse=True)) + ")"),
+    ("pronunciation", r'(?<!\w)(?:' + "|".join(re.escape(word) for word in sorted(PRONUNCIATIONS, key=len, reverse=True)) + r')(?!\w)'),
+]
+SPOKEN_FORMS = re.compile("|".join(f"(?P<{kind}>{pattern})" for kind, pattern in SPOKEN_FORM_RULES))
+NORMALIZE_CACHE_SENTENCES = 8192
+
+# Dialogue mode: quoted speech is read in a voice picked from the speaker's name, the selected voice narrates
+DIALOGUE_WORKERS = int(os.environ.get('ECHOVERSE_DIALOGUE_WORKERS', '4'))
+DIALOGUE_TAG_CHARS = 80
+SPEECH_VERBS = ("said|says|asked|asks|replied|answered|whispered|shouted|cried|called|muttered|murmured|exclaimed|"
+                "added|continued|yelled|snapped|sighed|laughed|began|insisted|demanded|explained|told")
+SPEAKER_NAME = r'(?:(?:Mr|Mrs|Ms|Dr|Miss|Lady|Lord|Sir|Captain|Professor)\.?\s+)?[A-Z][a-z]+'
+SPEAKER_PRONOUNS = {"I", "He", "She", "They", "We", "You", "It"}
+QUOTED_SPEECH = re.compile(r'"([^"\n]+)"|“([^”\n]+)”')
+# "...," said Anna  /  "...," Anna said
+SPEAKER_AFTER = re.compile(rf'[ \t]*(?:(?:{SPEECH_VERBS})\s+(?P<after_verb>{SPEAKER_NAME})|(?P<before_verb>{SPEAKER_NAME})\s+(?:{SPEECH_VERBS}))\b')
+# Anna said, "..."
+SPEAKER_BEFORE = re.compile(rf'(?P<name>{SPEAKER_NAME})\s+(?:{SPEECH_VERBS})(?:\s+\w+)?\s*[,:]?\s*$')
+
+ESPEAK_VOICES = {
+    Voice.MALE_DEEP: "en+m3",
+    Voice.MALE_MEDIUM: "en+m1",
+    Voice.MALE_YOUNG: "en+m5",
+    Voice.FEMALE_SOPRANO: "en+f5",
+    Voice.FEMALE_ALTO: "en+f2",
+    Voice.FEMALE_MATURE: "en+f4"
+}
+
+def voice_config(voice: Voice) -> dict:
+    return VOICE_CONFIGS.get(voice, VOICE_CONFIGS[Voice.MALE_MEDIUM])
+
 @dataclass
 class Narration:
     id: str
@@ -39,140 +280,1917 @@ class Narration:
     tone: Tone
     voice: Voice
     timestamp: datetime
-    audio_bytes: bytes
+    audio_key: str
+    timings: dict = None
+    # Per chunk: {"source": hash of the input chunk, "text": rewritten text, "audio_key": cached segment audio}
+    segments: list = None
+    dialogue: bool = False
+    # File name for narrations of uploads, whose original_text is only the opening of the file
+    upload: str = None
+
+@dataclass
+class HistoryEntry:
+    """All a session keeps about a past narration; text and audio stay in the HistoryStore"""
+    id: str
+    preview: str
+    tone: Tone
+    voice: Voice
+    timestamp: datetime
+
+class Settings:
+    """KEY=value lines from api_keys.txt, re-parsed only when the file's mtime or size changes"""
+
+    def __init__(self, path: str, check_interval: float):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._values = {}
+        self._signature = None
+        self._checked = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked is not None and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+            if signature == self._signature:
+                return
+            values = {}
+            if signature is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            key, sep, value = line.strip().partition('=')
+                            if sep and not key.startswith('#'):
+                                values[key.strip()] = value.strip()
+                except OSError:
+                    signature = None
+            if self._signature is not None:
+                print(f"🔄 Reloaded settings from {self.path}")
+            self._signature = signature
+            self._values = values
+
+    def get(self, name: str, default=None):
+        self._refresh()
+        return self._values.get(name, default)
+
+    @property
+    def gemini_api_key(self):
+        key = self.get('GEMINI_API_KEY')
+        return key if key and key != 'your_gemini_api_key_here' else None
+
+@st.cache_resource
+def get_settings() -> Settings:
+    return Settings(API_KEYS_PATH, SETTINGS_CHECK_SECONDS)
 
 def read_api_keys():
+    return get_settings().gemini_api_key
+
+@lru_cache(maxsize=None)
+def load_genai():
+    """google.generativeai takes a long time to import, so it is loaded on the first Gemini call"""
+    import google.generativeai as genai
+    return genai
+
+@lru_cache(maxsize=None)
+def load_google_exceptions():
     try:
-        with open('api_keys.txt', 'r', encoding='utf-8') as f:
-            content = f.read()
-        gemini_key = None
-        for line in content.split('\n'):
-            line = line.strip()
-            if line.startswith('GEMINI_API_KEY='):
-                gemini_key = line.split('=', 1)[1].strip()
-        if gemini_key and gemini_key != 'your_gemini_api_key_here':
-            return gemini_key
-        else:
-            return None
-    except Exception:
+        from google.api_core import exceptions
+    except ImportError:
         return None
+    return exceptions
+
+@contextmanager
+def sqlite_connection(path: str):
+    """Short-lived WAL connection that commits on success and always closes"""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+class JsonlMetricsSink:
+    """Appends every metric event as one JSON line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+class Metrics:
+    """Process-wide counters, span timings and byte sizes; pull as Prometheus text or push to sinks"""
+
+    def __init__(self, sinks: list = None):
+        self.sinks = sinks or []
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    @staticmethod
+    def _series(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _emit(self, kind: str, name: str, value: float, labels: dict):
+        if not self.sinks:
+            return
+        event = {"ts": round(time.time(), 3), "type": kind, "name": name, "value": value, "labels": labels}
+        for sink in self.sinks:
+            try:
+                sink.emit(event)
+            except Exception as e:
+                print(f"Metrics sink error: {e}")
+
+    def increment(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._counters[self._series(name, labels)] += value
+        self._emit("counter", name, value, labels)
+
+    def observe(self, name: str, value: float, buckets: tuple = None, **labels):
+        buckets = buckets or SECONDS_BUCKETS
+        with self._lock:
+            series = self._series(name, labels)
+            histogram = self._histograms.get(series)
+            if histogram is None:
+                histogram = self._histograms[series] = {"buckets": buckets, "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+        self._emit("observation", name, value, labels)
+
+    def record_bytes(self, name: str, size: int, **labels):
+        self.observe(f"{name}_bytes", size, buckets=BYTES_BUCKETS, **labels)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time a block as <name>_seconds, labelled with whether it raised"""
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - started, status=status, **labels)
+
+    def render_prometheus(self) -> str:
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+            return "{" + ",".join(escaped) + "}"
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((series, dict(h, counts=list(h["counts"]))) for series, h in self._histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"echoverse_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{label_text(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            metric = f"echoverse_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                lines.append(f"{metric}_bucket{label_text(labels, [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{metric}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{metric}_sum{label_text(labels)} {histogram['sum']:g}")
+            lines.append(f"{metric}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    sinks = []
+    if METRICS_JSONL_PATH:
+        sinks.append(JsonlMetricsSink(METRICS_JSONL_PATH))
+    return Metrics(sinks)
+
+class GeminiThrottled(Exception):
+    """The limiter refused a call: the circuit is open or the queue wait ran out"""
+
+def classify_gemini_error(error: Exception) -> str:
+    """Map a Gemini SDK exception to auth, quota, rate_limit, unavailable, throttled or other"""
+    if isinstance(error, GeminiThrottled):
+        return "throttled"
+    google_exceptions = load_google_exceptions()
+    if google_exceptions is not None:
+        if isinstance(error, (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied)):
+            return "auth"
+        # ResourceExhausted is a TooManyRequests subclass, so it has to be checked first
+        if isinstance(error, google_exceptions.ResourceExhausted):
+            return "quota"
+        if isinstance(error, google_exceptions.TooManyRequests):
+            return "rate_limit"
+        if isinstance(error, (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded, google_exceptions.InternalServerError)):
+            return "unavailable"
+        if isinstance(error, google_exceptions.InvalidArgument) and "api key" in str(error).lower():
+            return "auth"
+        if isinstance(error, google_exceptions.GoogleAPICallError):
+            return "other"
+    # The SDK's own key check happens before any API call and only carries a message
+    if "api key" in str(error).lower():
+        return "auth"
+    return "other"
+
+class RewriteCache:
+    """SQLite-backed memo of Gemini rewrites with TTL, size cap and in-flight coalescing"""
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rewrites (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS rewrites_accessed ON rewrites (accessed)")
+
+    def _connect(self):
+        return sqlite_connection(self.path)
+
+    @staticmethod
+    def make_key(model_name: str, prompt_template: str, temperature: float, text: str) -> str:
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        payload = json.dumps({"model": model_name, "prompt": prompt_template, "temperature": temperature, "text": text_hash}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM rewrites WHERE key = ? AND created > ?", (key, now - self.ttl_seconds)).fetchone()
+            if row:
+                conn.execute("UPDATE rewrites SET accessed = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        get_metrics().increment("rewrite_cache_lookups", result="hit" if row else "miss")
+        return row[0] if row else None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO rewrites (key, value, created, accessed) VALUES (?, ?, ?, ?)", (key, value, now, now))
+            conn.execute("DELETE FROM rewrites WHERE created <= ?", (now - self.ttl_seconds,))
+            conn.execute("DELETE FROM rewrites WHERE key IN (SELECT key FROM rewrites ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def get_or_compute(self, key: str, compute) -> str:
+        """Return the cached value, or run compute() once even if several sessions ask at the same time"""
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            get_metrics().increment("rewrite_cache_lookups", result="coalesced")
+            return future.result()
+        try:
+            value = compute()
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get_or_compute_many(self, keys: list, compute) -> dict:
+        """Like get_or_compute for several keys; compute(missing_keys) returns a dict for those nobody else is computing"""
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        owned, waiting = {}, {}
+        with self._lock:
+            for key in keys:
+                if key in values:
+                    continue
+                future = self._inflight.get(key)
+                if future is None:
+                    owned[key] = self._inflight[key] = Future()
+                else:
+                    self.coalesced += 1
+                    waiting[key] = future
+        try:
+            computed = compute(list(owned)) if owned else {}
+            for key, future in owned.items():
+                if key in computed:
+                    self.put(key, computed[key])
+                    values[key] = computed[key]
+                    future.set_result(computed[key])
+                else:
+                    # Left out of the batch answer; waiters fall back to their own single request
+                    future.set_exception(LookupError(key))
+        except BaseException as e:
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for key in owned:
+                    self._inflight.pop(key, None)
+        for key, future in waiting.items():
+            get_metrics().increment("rewrite_cache_lookups", result="coalesced")
+            try:
+                values[key] = future.result()
+            except Exception:
+                pass
+        return values
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+
+@st.cache_resource
+def get_rewrite_cache() -> RewriteCache:
+    return RewriteCache(os.path.join(CACHE_DIR, 'rewrites.sqlite3'), REWRITE_CACHE_TTL_SECONDS, REWRITE_CACHE_MAX_ENTRIES)
+
+@st.cache_resource
+def get_gemini_model(api_key: str):
+    genai = load_genai()
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(REWRITE_MODEL)
+
+class RewritePriority(IntEnum):
+    """Lower values are served first when Gemini calls queue up"""
+    FIRST_AUDIO = 0
+    INTERACTIVE = 1
+    BATCH = 2
+
+class GeminiRateLimiter:
+    """Token bucket with priority queuing, AIMD rate adaptation, jittered backoff and a circuit breaker"""
+
+    def __init__(self, requests_per_minute: float, burst: int, max_retries: int, max_wait: float,
+                 breaker_threshold: int, breaker_cooldown: float):
+        self.max_rate = requests_per_minute / 60
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._cond = threading.Condition()
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._waiting = []
+        self._sequence = count()
+        self._failures = 0
+        self._open_until = None
+        self._probing = False
+
+    def _refill_locked(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _check_breaker_locked(self, now: float):
+        if self._open_until is None:
+            return
+        if now < self._open_until:
+            raise GeminiThrottled(f"Gemini circuit open for another {self._open_until - now:.0f}s")
+        if self._probing:
+            # Half-open: one trial call decides whether the circuit closes again
+            raise GeminiThrottled("Gemini circuit half-open, waiting on a trial call")
+
+    def acquire(self, priority: RewritePriority, deadline: float):
+        """Block until this caller is first in line and a token is available"""
+        entry = (int(priority), next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._check_breaker_locked(now)
+                    self._refill_locked(now)
+                    if self._waiting[0] == entry and self._tokens >= 1:
+                        self._tokens -= 1
+                        if self._open_until is not None:
+                            self._probing = True
+                        return
+                    if now >= deadline:
+                        raise GeminiThrottled("Timed out waiting for a Gemini rate limit slot")
+                    wait = deadline - now
+                    if self._waiting[0] == entry:
+                        wait = min(wait, (1 - self._tokens) / self.rate)
+                    if self._open_until is not None:
+                        wait = min(wait, max(0.0, self._open_until - now))
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def record_success(self):
+        with self._cond:
+            self._failures = 0
+            self._open_until = None
+            self._probing = False
+            # Additive increase back towards the configured rate
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+            self._cond.notify_all()
+
+    def record_throttle(self, retry_after: float = None):
+        with self._cond:
+            now = time.monotonic()
+            self._refill_locked(now)
+            self._failures += 1
+            # Multiplicative decrease, and drain the bucket so queued callers back off too
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            if self._probing or self._failures >= self.breaker_threshold:
+                self._open_until = now + max(self.breaker_cooldown, retry_after or 0)
+                self._probing = False
+                get_metrics().increment("gemini_breaker_opens")
+                print(f"⚠️ Gemini circuit open for {self._open_until - now:.0f}s after {self._failures} throttled calls")
+            self._cond.notify_all()
+
+    def record_error(self):
+        """A non-throttling failure says nothing about capacity, but ends a half-open trial"""
+        with self._cond:
+            if self._probing:
+                self._probing = False
+                self._open_until = time.monotonic()
+            self._cond.notify_all()
+
+    @staticmethod
+    def retry_after(error: Exception):
+        match = RETRY_DELAY.search(str(error))
+        return float(match.group(1)) if match else None
+
+    def call(self, fn, priority: RewritePriority = RewritePriority.INTERACTIVE):
+        """Run fn under the limiter, retrying throttled calls with full-jitter exponential backoff"""
+        metrics = get_metrics()
+        deadline = time.monotonic() + self.max_wait
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            self.acquire(priority, deadline)
+            metrics.observe("gemini_queue_wait_seconds", time.monotonic() - queued, priority=priority.name.lower())
+            try:
+                result = fn()
+            except Exception as e:
+                category = classify_gemini_error(e)
+                if category not in GEMINI_RETRYABLE_ERRORS:
+                    self.record_error()
+                    raise
+                retry_after = self.retry_after(e)
+                self.record_throttle(retry_after)
+                delay = max(retry_after or 0, random.uniform(0, min(GEMINI_BACKOFF_MAX_SECONDS, GEMINI_BACKOFF_BASE_SECONDS * 2 ** attempt)))
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                metrics.increment("gemini_retries", category=category)
+                time.sleep(delay)
+            else:
+                self.record_success()
+                return result
+
+@st.cache_resource
+def get_gemini_limiter() -> GeminiRateLimiter:
+    return GeminiRateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_BURST, GEMINI_MAX_RETRIES, GEMINI_MAX_WAIT_SECONDS,
+                             GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_COOLDOWN_SECONDS)
 
 class GeminiService:
     @staticmethod
-    def rewrite_text_with_tone(text: str, tone: Tone) -> str:
+    def rewrite_text_with_tone(text: str, tone: Tone, priority: RewritePriority = RewritePriority.INTERACTIVE, on_fallback=None) -> str:
+        """Rewrite text in tone; on failure return the local fallback and pass the error category to on_fallback
+
+        This runs on worker threads, so it never calls st.* itself.
+        """
         try:
             gemini_key = read_api_keys()
             if not gemini_key:
+                get_metrics().increment("rewrite_fallbacks", reason="no_api_key")
+                if on_fallback:
+                    on_fallback("no_api_key")
                 return GeminiService.simple_rewrite_fallback(text, tone)
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            tone_prompts = {
-                Tone.DRAMATIC: "Make this text slightly more engaging and impactful while keeping the original content mostly unchanged:",
-                Tone.CALM: "Make this text slightly more peaceful and easy to read while preserving the original message:",
-                Tone.EXCITING: "Add subtle energy to this text while maintaining the original meaning:",
-                Tone.MYSTERIOUS: "Give this text a subtle mysterious feel while keeping the original content:",
-                Tone.ROMANTIC: "Add gentle warmth to this text while preserving the original meaning:"
-            }
-            prompt = f"{tone_prompts[tone]}\n\n{text}"
-            response = model.generate_content(prompt, generation_config=genai.types.GenerationConfig(temperature=0.1))
-            return response.text.strip()
+            key = RewriteCache.make_key(REWRITE_MODEL, TONE_PROMPTS[tone], REWRITE_TEMPERATURE, text)
+            limiter = get_gemini_limiter()
+            return get_rewrite_cache().get_or_compute(key, lambda: limiter.call(lambda: GeminiService.generate_rewrite(text, tone, gemini_key), priority))
         except Exception as e:
-            error_msg = str(e).lower()
-            if "api key" in error_msg or "invalid" in error_msg:
-                st.error("❌ Invalid Gemini API key. Please check your api_keys.txt file.")
-            elif "quota" in error_msg or "429" in error_msg:
-                st.warning("⚠️ Gemini API quota exceeded. Using fallback rewrite.")
-            elif "rate limit" in error_msg:
-                st.warning("⚠️ Gemini API rate limit reached. Using fallback rewrite.")
-            else:
-                st.error(f"❌ Error: {e}")
+            category = classify_gemini_error(e)
+            get_metrics().increment("gemini_errors", category=category)
+            get_metrics().increment("rewrite_fallbacks", reason=category)
+            print(f"⚠️ Rewrite failed ({category}), using fallback: {e}")
+            if on_fallback:
+                on_fallback(category)
             return GeminiService.simple_rewrite_fallback(text, tone)
+
+    @staticmethod
+    def generate_rewrite(text: str, tone: Tone, gemini_key: str) -> str:
+        model = get_gemini_model(gemini_key)
+        prompt = f"{TONE_PROMPTS[tone]}\n\n{text}"
+        with get_metrics().span("rewrite", model=REWRITE_MODEL):
+            response = model.generate_content(prompt, generation_config=load_genai().types.GenerationConfig(temperature=REWRITE_TEMPERATURE))
+        return response.text.strip()
     
+    @staticmethod
+    def generate_rewrites(items: list, gemini_key: str) -> list:
+        """Rewrite several (text, tone) pairs in one JSON-mode request; None where the answer lacks an item"""
+        model = get_gemini_model(gemini_key)
+        request = [{"id": str(i), "instruction": TONE_PROMPTS[tone], "text": text} for i, (text, tone) in enumerate(items)]
+        prompt = f"{REWRITE_BATCH_PROMPT}\n\n{json.dumps(request, ensure_ascii=False)}"
+        config = load_genai().types.GenerationConfig(temperature=REWRITE_TEMPERATURE, response_mime_type="application/json")
+        with get_metrics().span("rewrite_batch", model=REWRITE_MODEL):
+            response = model.generate_content(prompt, generation_config=config)
+        try:
+            answer = json.loads(response.text)
+        except ValueError:
+            answer = {}
+        if not isinstance(answer, dict):
+            answer = {}
+        results = []
+        for i in range(len(items)):
+            value = answer.get(str(i))
+            results.append(value.strip() if isinstance(value, str) and value.strip() else None)
+        get_metrics().increment("rewrite_batch_items", len(items), result="ok")
+        get_metrics().increment("rewrite_batch_items", results.count(None), result="missing")
+        return results
+
+    @staticmethod
+    def plan_batches(items: list) -> list:
+        """Group (key, text, tone) items into requests under the item and character limits"""
+        batches, current, chars = [], [], 0
+        for item in items:
+            if current and (len(current) >= REWRITE_BATCH_MAX_ITEMS or chars + len(item[1]) > REWRITE_BATCH_MAX_CHARS):
+                batches.append(current)
+                current, chars = [], 0
+            current.append(item)
+            chars += len(item[1])
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def rewrite_many(items: list, priority: RewritePriority = RewritePriority.INTERACTIVE, on_fallback=None) -> list:
+        """Rewrite (text, tone) pairs with as few Gemini requests as possible, caching each result under its single-rewrite key"""
+        gemini_key = read_api_keys()
+        results = {}
+        if gemini_key:
+            keys = [RewriteCache.make_key(REWRITE_MODEL, TONE_PROMPTS[tone], REWRITE_TEMPERATURE, text) for text, tone in items]
+            by_key = dict(zip(keys, items))
+            limiter = get_gemini_limiter()
+
+            def request(batch):
+                try:
+                    texts = limiter.call(lambda: GeminiService.generate_rewrites([(text, tone) for _, text, tone in batch], gemini_key), priority)
+                except Exception as e:
+                    # Items from a failed batch are retried one by one below, with the usual fallback
+                    get_metrics().increment("gemini_errors", category=classify_gemini_error(e))
+                    print(f"⚠️ Batched rewrite failed: {e}")
+                    return {}
+                return {key: value for (key, _, _), value in zip(batch, texts) if value is not None}
+
+            def compute(missing):
+                computed = {}
+                batches = GeminiService.plan_batches([(key, *by_key[key]) for key in missing])
+                for answer in get_pipeline_executor().map(request, batches):
+                    computed.update(answer)
+                return computed
+
+            try:
+                results = get_rewrite_cache().get_or_compute_many(keys, compute)
+            except Exception as e:
+                print(f"⚠️ Batched rewrite failed: {e}")
+            return [results.get(key) or GeminiService.rewrite_text_with_tone(*by_key[key], priority, on_fallback) for key in keys]
+        return [GeminiService.rewrite_text_with_tone(text, tone, priority, on_fallback) for text, tone in items]
+
     @staticmethod
     def simple_rewrite_fallback(text: str, tone: Tone) -> str:
-        tone_prefixes = {
-            Tone.DRAMATIC: "🎭 DRAMATICALLY: ",
-            Tone.CALM: "😌 CALMLY: ",
-            Tone.EXCITING: "⚡ EXCITINGLY: ",
-            Tone.MYSTERIOUS: "🔮 MYSTERIOUSLY: ",
-            Tone.ROMANTIC: "💕 ROMANTICALLY: "
-        }
-        return f"{tone_prefixes[tone]}{text}"
+        return f"{TONE_FALLBACK_PREFIXES[tone]}{text}"
+
+class AudioCache:
+    """Content-addressed audio files on disk with LRU eviction under a byte budget
+
+    The directory is the shared state: every process using it rescans it before evicting, and
+    file mtimes carry the LRU order between them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Keyed by file name (key.ext) so encoded variants share the budget
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._scanned = 0.0
+        # Entries being read to render something derived from them; eviction passes over these
+        self._pins = Counter()
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._scan_locked()
 
-class TTSService:
     @staticmethod
-    def generate_audio(text: str, voice: Voice) -> bytes:
+    def make_key(text: str, voice: Voice, config: dict, engine: str = "pyttsx3") -> str:
+        payload = json.dumps({"text": text, "voice": voice.value, "config": config, "engine": engine}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str, ext: str = "wav") -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def touch(self, key: str, ext: str = "wav") -> bool:
+        """Mark an entry as recently used; False when it is not on disk"""
+        name = f"{key}.{ext}"
         try:
-            print(f"🎤 Generating real speech audio for voice: {voice.value}")
-            return TTSService.generate_real_speech(text, voice)
-        except Exception as e:
-            print(f"❌ TTS Error: {e}")
-            return TTSService.create_speech_fallback(text, voice)
-    
+            os.utime(self.path_for(key, ext))
+        except OSError:
+            with self._lock:
+                self._bytes -= self._entries.pop(name, 0)
+            return False
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+            else:
+                size = os.path.getsize(self.path_for(key, ext))
+                self._entries[name] = size
+                self._bytes += size
+        return True
+
+    def put_content(self, data: bytes) -> str:
+        """Store audio under the hash of its own bytes and return that key"""
+        key = hashlib.sha256(data).hexdigest()
+        if not self.touch(key):
+            self.put(key, data)
+        return key
+
+    def get(self, key: str, ext: str = "wav"):
+        name = f"{key}.{ext}"
+        path = self.path_for(key, ext)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                self._bytes -= self._entries.pop(name, 0)
+            get_metrics().increment("audio_cache_lookups", result="miss")
+            return None
+        with self._lock:
+            self.hits += 1
+            if name not in self._entries:
+                self._entries[name] = len(data)
+                self._bytes += len(data)
+            self._entries.move_to_end(name)
+        get_metrics().increment("audio_cache_lookups", result="hit")
+        return data
+
+    def put(self, key: str, data: bytes, ext: str = "wav") -> str:
+        return self.put_stream(key, [data], ext)
+
+    def put_stream(self, key: str, blocks, ext: str = "wav", finalize=None) -> str:
+        """Write an iterable of byte blocks as one entry without holding it all in memory
+
+        finalize(file, size), if given, runs before the entry becomes visible, e.g. to patch a header.
+        """
+        # Write to a sibling temp file and rename so readers never see partial audio
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in blocks:
+                    f.write(block)
+                    size += len(block)
+                if finalize:
+                    finalize(f, size)
+            return self.put_file(key, temp_path, ext)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def put_file(self, key: str, temp_path: str, ext: str = "wav") -> str:
+        """Move a finished file, written inside the cache directory, into place as an entry"""
+        name = f"{key}.{ext}"
+        path = self.path_for(key, ext)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict_locked()
+        return path
+
+    def _scan_locked(self):
+        """Rebuild the LRU order from file mtimes, picking up files other processes added, touched or evicted"""
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.part'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(found))
+        self._bytes = sum(self._entries.values())
+        self._scanned = time.monotonic()
+
+    @contextmanager
+    def pinned(self, *keys: str, ext: str = "wav"):
+        """Keep entries on disk while something derived from them is rendered; the budget may overrun meanwhile"""
+        names = [f"{key}.{ext}" for key in keys]
+        with self._lock:
+            self._pins.update(names)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins.subtract(names)
+                self._pins = +self._pins
+
+    def _evict_locked(self):
+        if self._bytes > self.max_bytes or time.monotonic() - self._scanned > AUDIO_CACHE_RESCAN_SECONDS:
+            self._scan_locked()
+        # The newest entry always stays, as do pinned ones
+        for name in list(self._entries)[:-1]:
+            if self._bytes <= self.max_bytes:
+                break
+            if name in self._pins:
+                continue
+            size = self._entries.pop(name)
+            self._bytes -= size
+            self.evictions += 1
+            get_metrics().increment("audio_cache_evictions")
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+@dataclass(frozen=True)
+class AudioFormat:
+    label: str
+    extension: str
+    mime_type: str
+    encoder: str = ""
+    ffmpeg_args: tuple = ()
+
+AUDIO_FORMATS = {
+    "wav": AudioFormat("WAV (lossless, largest)", "wav", "audio/wav"),
+    "flac": AudioFormat("FLAC (lossless)", "flac", "audio/flac", "flac", ("-c:a", "flac", "-f", "flac")),
+    "mp3": AudioFormat("MP3 (64 kbps)", "mp3", "audio/mpeg", "libmp3lame", ("-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3")),
+    "opus": AudioFormat("Opus (32 kbps, smallest)", "opus", "audio/ogg", "libopus", ("-c:a", "libopus", "-b:a", "32k", "-f", "ogg")),
+}
+
+class AudioEncoder:
+    """Streams WAV through ffmpeg into compressed formats; WAV is always available"""
+
+    def __init__(self):
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.formats = ["wav"]
+        if not self.ffmpeg:
+            print("ffmpeg not found, audio will only be offered as WAV")
+            return
+        try:
+            result = subprocess.run([self.ffmpeg, '-hide_banner', '-encoders'], capture_output=True, text=True, timeout=PROBE_TIMEOUT_SECONDS)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"ffmpeg probe failed: {e}")
+            return
+        for name, audio_format in AUDIO_FORMATS.items():
+            if audio_format.encoder and f" {audio_format.encoder} " in result.stdout:
+                self.formats.append(name)
+
+    def encode_stream(self, wav_blocks, fmt: str):
+        """Yield encoded bytes as ffmpeg produces them while WAV blocks are still being fed in"""
+        audio_format = AUDIO_FORMATS[fmt]
+        if fmt == "wav":
+            yield from wav_blocks
+            return
+        command = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'wav', '-i', 'pipe:0', *audio_format.ffmpeg_args, 'pipe:1']
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        def feed():
+            try:
+                for block in wav_blocks:
+                    process.stdin.write(block)
+            except (BrokenPipeError, OSError):
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+        # stderr is drained on its own thread so a chatty ffmpeg cannot block on a full pipe
+        errors = []
+        feeder = threading.Thread(target=feed, daemon=True)
+        drainer = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        feeder.start()
+        drainer.start()
+        try:
+            while True:
+                block = process.stdout.read(ENCODE_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            feeder.join()
+            drainer.join()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {fmt}: {b''.join(errors).decode(errors='replace').strip()}")
+
+    def transcode(self, cache: AudioCache, key: str, fmt: str) -> str:
+        """Return the path of the cached encoding of a WAV entry, encoding it on first use"""
+        if fmt not in self.formats:
+            raise RuntimeError(f"{fmt!r} audio is not available here (ffmpeg with its encoder is needed); use one of {', '.join(self.formats)}")
+        extension = AUDIO_FORMATS[fmt].extension
+        if fmt == "wav" or cache.touch(key, extension):
+            return cache.path_for(key, extension)
+        with get_metrics().span("encode", format=fmt), cache.pinned(key), open(cache.path_for(key), 'rb') as source:
+            blocks = iter(lambda: source.read(ENCODE_BLOCK_SIZE), b"")
+            path = cache.put_stream(key, self.encode_stream(blocks, fmt), extension)
+        get_metrics().record_bytes("encoded_audio", os.path.getsize(path), format=fmt)
+        return path
+
+@st.cache_resource
+def get_audio_encoder() -> AudioEncoder:
+    return AudioEncoder()
+
+def wav_header(sample_rate: int, channels: int, sample_width: int, data_size: int) -> bytes:
+    block_align = channels * sample_width
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels,
+                       sample_rate, sample_rate * block_align, block_align, 8 * sample_width, b'data', data_size)
+
+def patch_wav_sizes(f, size: int):
+    """Fill in the RIFF and data sizes of a WAV written with a placeholder header"""
+    f.seek(4)
+    f.write(struct.pack('<I', size - 8))
+    f.seek(WAV_HEADER_SIZE - 4)
+    f.write(struct.pack('<I', size - WAV_HEADER_SIZE))
+
+def wav_layout(path: str) -> tuple:
+    """((channels, sample width, frame rate), data offset, data size) of a WAV file, read from its chunk headers only"""
+    file_size = os.path.getsize(path)
+    params = None
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                _, channels, rate, _, _, bits = struct.unpack('<HHIIHH', f.read(16))
+                params = (channels, bits // 8, rate)
+                f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b'data':
+                if params is None:
+                    raise ValueError(f"{path} has no fmt chunk")
+                offset = f.tell()
+                # Engines that stream to stdout leave a placeholder size; the file length is the truth
+                return params, offset, min(chunk_size, file_size - offset)
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+class WavAssembler:
+    """Appends cached WAV segments to one file as they arrive, then patches its header sizes in place
+
+    Segment samples are copied straight out of memory maps, so memory use does not grow with the length of the book.
+    """
+
+    def __init__(self, cache: 'AudioCache'):
+        self.cache = cache
+        self.params = None
+        self.data_size = 0
+        self._hash = hashlib.sha256()
+        fd, self._temp_path = tempfile.mkstemp(dir=cache.directory, suffix='.part')
+        self._file = os.fdopen(fd, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # Whatever was not handed to the cache is discarded
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._temp_path is not None:
+            try:
+                os.unlink(self._temp_path)
+            except OSError:
+                pass
+        return False
+
+    def append(self, key: str) -> float:
+        """Append a cached segment's samples and return its duration in seconds"""
+        path = self.cache.path_for(key)
+        params, offset, size = wav_layout(path)
+        if self.params is None:
+            self.params = params
+            channels, sample_width, rate = params
+            self._file.write(wav_header(rate, channels, sample_width, 0))
+            self._hash.update(repr(params).encode('ascii'))
+        elif params != self.params:
+            raise ValueError(f"Cannot stitch WAV segments with different formats: {params} != {self.params}")
+        if size:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                samples = view[offset:offset + size]
+                self._file.write(samples)
+                self._hash.update(samples)
+                samples.release()
+        self.data_size += size
+        channels, sample_width, rate = params
+        return size / (channels * sample_width * rate)
+
+    def finish(self):
+        """Move the assembled WAV into the cache and return its key, or None when nothing was appended"""
+        if self.params is None:
+            return None
+        patch_wav_sizes(self._file, WAV_HEADER_SIZE + self.data_size)
+        self._file.close()
+        self._file = None
+        key = self._hash.hexdigest()
+        self.cache.put_file(key, self._temp_path)
+        self._temp_path = None
+        return key
+
+@dataclass(frozen=True)
+class AudioEffects:
+    volume: float = 1.0
+    speed: float = 1.0
+    normalize: bool = True
+    trim_silence: bool = True
+
+    @property
+    def identity(self) -> bool:
+        return self.volume == 1.0 and self.speed == 1.0 and not self.normalize and not self.trim_silence
+
+class TimeStretcher:
+    """Streaming WSOLA: changes tempo without changing pitch, one block of float samples at a time"""
+
+    def __init__(self, sample_rate: int, speed: float):
+        import numpy as np
+        self.frame = 2 * int(sample_rate * STRETCH_FRAME_SECONDS / 2)
+        self.synthesis_hop = self.frame // 2
+        self.analysis_hop = self.synthesis_hop * speed
+        self.tolerance = int(sample_rate * STRETCH_TOLERANCE_SECONDS)
+        # Periodic Hann window: frames overlapping by half sum to one
+        self.window = np.hanning(self.frame + 1)[:-1].astype(np.float32)
+        self._input = np.zeros(0, dtype=np.float32)
+        self._input_start = 0
+        self._output = np.zeros(self.frame, dtype=np.float32)
+        self._frames = 0
+        self._previous = None
+
+    def _segment(self, start: int, length: int):
+        offset = start - self._input_start
+        return self._input[offset:offset + length]
+
+    def _best_start(self, natural: int, low: int, high: int) -> int:
+        """Input position in [low, high] whose frame best continues the waveform at natural"""
+        import numpy as np
+        template = self._segment(natural, self.frame)
+        region = self._segment(low, high - low + self.frame)
+        step = STRETCH_SEARCH_STEP
+        # Coarse search on decimated signals, then refine around the winner at full resolution
+        coarse = low + step * int(np.argmax(np.correlate(region[::step], template[::step], mode='valid')))
+        fine_low = max(low, coarse - step + 1)
+        fine_high = min(high, coarse + step - 1)
+        fine = np.correlate(self._segment(fine_low, fine_high - fine_low + self.frame), template, mode='valid')
+        return fine_low + int(np.argmax(fine))
+
+    def _place_frames(self, final: bool) -> list:
+        import numpy as np
+        finished = []
+        limit = self._input_start + len(self._input)
+        while True:
+            nominal = int(round(self._frames * self.analysis_hop))
+            if final and nominal >= limit:
+                break
+            if self._previous is None:
+                low = high = natural = nominal
+            else:
+                natural = self._previous + self.synthesis_hop
+                low = max(nominal - self.tolerance, self._input_start)
+                high = nominal + self.tolerance
+            needed = max(high, natural) + self.frame
+            available = self._input_start + len(self._input)
+            if needed > available:
+                if not final:
+                    break
+                self._input = np.concatenate([self._input, np.zeros(needed - available, dtype=np.float32)])
+            start = nominal if self._previous is None else self._best_start(natural, low, high)
+            self._output += self.window * self._segment(start, self.frame)
+            finished.append(self._output[:self.synthesis_hop].copy())
+            self._output = np.concatenate([self._output[self.synthesis_hop:], np.zeros(self.synthesis_hop, dtype=np.float32)])
+            self._previous = start
+            self._frames += 1
+            # Drop input that no later frame can reach
+            keep_from = min(int(round(self._frames * self.analysis_hop)) - self.tolerance, start + self.synthesis_hop)
+            if keep_from > self._input_start:
+                self._input = self._input[keep_from - self._input_start:]
+                self._input_start = keep_from
+        return finished
+
+    def process(self, samples) -> list:
+        import numpy as np
+        self._input = np.concatenate([self._input, samples])
+        return self._place_frames(final=False)
+
+    def flush(self) -> list:
+        finished = self._place_frames(final=True)
+        finished.append(self._output[:self.synthesis_hop])
+        return finished
+
+class AudioProcessor:
+    """Vectorized post-processing of cached narration WAVs: normalize, gain, time-stretch and silence trim"""
+
+    @staticmethod
+    def key_for(key: str, effects: AudioEffects) -> str:
+        payload = json.dumps({"source": key, **asdict(effects)}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def read_blocks(path: str):
+        """Yield (sample_rate, float32 samples in [-1, 1]) for a 16-bit mono WAV, a block at a time"""
+        import numpy as np
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1:
+                raise ValueError("Audio effects need 16-bit mono WAV")
+            rate = wav_file.getframerate()
+            while True:
+                data = wav_file.readframes(DSP_BLOCK_FRAMES)
+                if not data:
+                    break
+                yield rate, np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def analyze(path: str) -> tuple:
+        """One pass for the peak level and the number of leading silent samples to drop"""
+        import numpy as np
+        peak, position, lead, rate = 0.0, 0, None, 22050
+        for rate, samples in AudioProcessor.read_blocks(path):
+            if samples.size:
+                peak = max(peak, float(np.abs(samples).max()))
+            if lead is None:
+                loud = np.flatnonzero(np.abs(samples) > DSP_SILENCE_THRESHOLD)
+                if loud.size:
+                    lead = position + int(loud[0])
+            position += samples.size
+        pad = int(rate * DSP_SILENCE_PAD_SECONDS)
+        return peak, max(0, (lead or 0) - pad), rate
+
+    @staticmethod
+    def render(path: str, effects: AudioEffects):
+        """Yield a WAV (placeholder header first) with the effects applied, block by block"""
+        import numpy as np
+        peak, lead, rate = AudioProcessor.analyze(path)
+        gain = effects.volume * (DSP_NORMALIZE_PEAK / peak if effects.normalize and peak > 0 else 1.0)
+        stretcher = TimeStretcher(rate, effects.speed) if effects.speed != 1.0 else None
+        pad = int(rate * DSP_SILENCE_PAD_SECONDS)
+
+        def finish(blocks):
+            if stretcher is not None:
+                blocks = [out for block in blocks for out in stretcher.process(block)]
+            if not blocks:
+                return b""
+            samples = np.concatenate(blocks) * gain
+            return (np.clip(samples, -1.0, 32767 / 32768) * 32768).astype('<i2').tobytes()
+
+        yield wav_header(rate, 1, 2, 0)
+        skip = lead if effects.trim_silence else 0
+        # Trailing silence is held back until louder audio shows it was only a pause
+        pending, heard = [], False
+        for _, samples in AudioProcessor.read_blocks(path):
+            if skip:
+                dropped = min(skip, samples.size)
+                samples, skip = samples[dropped:], skip - dropped
+            if not effects.trim_silence:
+                yield finish([samples])
+                continue
+            loud = np.flatnonzero(np.abs(samples) > DSP_SILENCE_THRESHOLD)
+            if not loud.size:
+                pending.append(samples)
+                continue
+            last = int(loud[-1]) + 1
+            heard = True
+            yield finish(pending + [samples[:last]])
+            pending = [samples[last:]]
+        tail = np.concatenate(pending) if pending else np.zeros(0, dtype=np.float32)
+        yield finish([tail[:pad] if heard else tail])
+        if stretcher is not None:
+            flushed = stretcher.flush()
+            samples = np.concatenate(flushed) * gain
+            yield (np.clip(samples, -1.0, 32767 / 32768) * 32768).astype('<i2').tobytes()
+
     @staticmethod
-    def generate_real_speech(text: str, voice: Voice) -> bytes:
-        """Generate real speech using pyttsx3"""
+    def apply(cache: 'AudioCache', key: str, effects: AudioEffects) -> tuple:
+        """Return (audio key, seconds trimmed from the start) for the narration with the effects applied"""
+        if effects.identity:
+            return key, 0.0
+        path = cache.path_for(key)
+        _, lead, rate = AudioProcessor.analyze(path)
+        derived = AudioProcessor.key_for(key, effects)
+        if not cache.touch(derived):
+            with get_metrics().span("dsp", speed=effects.speed), cache.pinned(key):
+                cache.put_stream(derived, AudioProcessor.render(path, effects), finalize=patch_wav_sizes)
+        return derived, (lead / rate if effects.trim_silence else 0.0)
+
+@st.cache_resource
+def get_audio_cache() -> AudioCache:
+    return AudioCache(os.path.join(CACHE_DIR, 'audio'), AUDIO_CACHE_MAX_BYTES)
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    """Serves registered media files straight from disk, with single-range support for seeking"""
+    routes = {}
+    chunk_size = 64 * 1024
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        url = urlsplit(self.path)
+        match = MEDIA_PATH.fullmatch(url.path)
+        directory = self.routes.get(match.group(1)) if match else None
+        path = os.path.join(directory, match.group(2)) if directory else None
+        try:
+            f = open(path, 'rb') if path else None
+        except OSError:
+            f = None
+        if f is None:
+            self.send_error(404)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size - 1
+            status = 200
+            range_header = self.headers.get('Range')
+            if range_header:
+                byte_range = parse_byte_range(range_header, size)
+                if byte_range is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.end_headers()
+                    return
+                start, end = byte_range
+                status = 206
+            self.send_response(status)
+            audio_format = AUDIO_FORMATS.get(os.path.splitext(path)[1][1:])
+            self.send_header('Content-Type', audio_format.mime_type if audio_format else mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Cache-Control', 'public, max-age=86400, immutable')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            disposition = content_disposition(parse_qs(url.query).get('download', [""])[0])
+            if disposition:
+                self.send_header('Content-Disposition', disposition)
+            self.end_headers()
+            if not send_body:
+                return
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    block = f.read(min(self.chunk_size, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the process's metrics at /metrics in Prometheus text format"""
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        if urlsplit(self.path).path != '/metrics':
+            self.send_error(404)
+            return
+        body = get_metrics().render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def content_disposition(download_name: str):
+    """Attachment header for a download name the app generated; None for anything else"""
+    if not DOWNLOAD_NAME.fullmatch(download_name) or download_name.strip('.') == "":
+        return None
+    return f'attachment; filename="{download_name}"'
+
+def parse_byte_range(header: str, size: int):
+    """Resolve a single 'bytes=' range against a file size; None when it cannot be satisfied"""
+    match = BYTE_RANGE.fullmatch(header.strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+def serve_http(bind: str, port: int, handler, name: str) -> ThreadingHTTPServer:
+    """Start an HTTP server on a daemon thread"""
+    httpd = ThreadingHTTPServer((bind, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name=name, daemon=True).start()
+    return httpd
+
+class MediaServer:
+    """Background HTTP server so pages reference audio by URL instead of embedding it"""
+
+    def __init__(self, bind: str, port: int, public_url: str):
+        self.handler = type('EchoverseMediaHandler', (MediaRequestHandler,), {'routes': {}})
+        self.httpd = serve_http(bind, port, self.handler, "echoverse-media")
+        self.base_url = public_url.rstrip('/')
+        print(f"✅ Media server listening on {bind}:{self.httpd.server_address[1]}, published as {self.base_url}")
+
+    def register(self, route: str, directory: str):
+        self.handler.routes[route] = directory
+
+    def url_for(self, route: str, filename: str, download_name: str = None) -> str:
+        url = f"{self.base_url}/{route}/{quote(filename)}"
+        if download_name:
+            url += f"?download={quote(download_name)}"
+        return url
+
+@st.cache_resource
+def get_media_server():
+    # Browsers can only reach it at an address the operator publishes, so without one Streamlit serves the audio
+    if not MEDIA_SERVER_URL:
+        return None
+    try:
+        server = MediaServer(MEDIA_SERVER_BIND, MEDIA_SERVER_PORT, MEDIA_SERVER_URL)
+    except OSError as e:
+        print(f"❌ Media server unavailable, serving audio through Streamlit: {e}")
+        return None
+    server.register('audio', get_audio_cache().directory)
+    return server
+
+@st.cache_resource
+def get_metrics_server():
+    try:
+        httpd = serve_http(METRICS_BIND, METRICS_PORT, MetricsRequestHandler, "echoverse-metrics")
+    except OSError as e:
+        print(f"❌ Metrics endpoint unavailable: {e}")
+        return None
+    print(f"✅ Metrics at http://{METRICS_BIND}:{httpd.server_address[1]}/metrics")
+    return httpd
+
+def media_url(path: str, mime_type: str, element: str):
+    """URL the page can load a cached audio file from, or None when only st.audio can serve it
+
+    element names the page element using the file, so Streamlit keeps it registered for this session's current run.
+    Raises ValueError for files over STREAMLIT_MEDIA_MAX_BYTES when there is no media server to stream them.
+    """
+    media_server = get_media_server()
+    if media_server is not None:
+        return media_server.url_for('audio', os.path.basename(path))
+    size = os.path.getsize(path)
+    if size > STREAMLIT_MEDIA_MAX_BYTES:
+        raise ValueError(f"{size / 1048576:.0f} MB is too large to serve through Streamlit")
+    try:
+        from streamlit import runtime
+        url = runtime.get_instance().media_file_mgr.add(path, mime_type, f"echoverse.{element}")
+    except Exception as e:
+        print(f"Streamlit media endpoint unavailable: {e}")
+        return None
+    base_path = (st.get_option("server.baseUrlPath") or "").strip('/')
+    return f"/{base_path}{url}" if base_path else url
+
+class EnginePool:
+    """Pre-configured pyttsx3 engines owned by dedicated worker threads, fed through a request queue"""
+
+    def __init__(self, workers: int):
+        self._requests = queue.Queue()
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._worker, args=(index,), name=f"echoverse-tts-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # Daemon workers are killed at exit without unwinding, so stop them while they can still clean up
+        atexit.register(self._shutdown)
+
+    def synthesize(self, text: str, voice: Voice, timeout: float = None) -> bytes:
+        future = Future()
+        self._requests.put((text, voice, future))
+        return future.result(timeout)
+
+    def close(self):
+        atexit.unregister(self._shutdown)
+        for _ in self._threads:
+            self._requests.put(None)
+
+    def _shutdown(self):
+        self.close()
+        for thread in self._threads:
+            thread.join(PROBE_TIMEOUT_SECONDS)
+
+    @staticmethod
+    def _configure(engine, voice: Voice, installed: list):
+        config = voice_config(voice)
+        engine.setProperty('rate', config["rate"])
+        engine.setProperty('volume', config["volume"])
+        if len(installed) > config["voice_id"]:
+            engine.setProperty('voice', installed[config["voice_id"]])
+
+    @staticmethod
+    def _create_engines() -> tuple:
+        """({voice: engine}, installed voice ids); every voice shares one engine where the driver state is global"""
+        import pyttsx3
+        # pyttsx3.init() would return one shared engine, so build them directly
+        engine = pyttsx3.Engine()
+        installed = [v.id for v in engine.getProperty('voices') or []]
+        if not ENGINE_PER_VOICE:
+            # A second espeak engine would reconfigure this one and take over its completion callback
+            return dict.fromkeys(Voice, engine), installed
+        engines = {}
+        for voice in Voice:
+            if engines:
+                engine = pyttsx3.Engine()
+            EnginePool._configure(engine, voice, installed)
+            engines[voice] = engine
+        return engines, installed
+
+    def _worker(self, index: int):
+        # SAPI5 engines are COM objects bound to the thread that created them
         try:
             import pythoncom
             pythoncom.CoInitialize()
-            
-            engine = pyttsx3.init()
-            
-            # Voice configuration based on voice type
-            voice_configs = {
-                Voice.MALE_DEEP: {"rate": 150, "volume": 0.9, "voice_id": 0},
-                Voice.MALE_MEDIUM: {"rate": 180, "volume": 0.8, "voice_id": 0},
-                Voice.MALE_YOUNG: {"rate": 200, "volume": 0.8, "voice_id": 0},
-                Voice.FEMALE_SOPRANO: {"rate": 220, "volume": 0.8, "voice_id": 1},
-                Voice.FEMALE_ALTO: {"rate": 190, "volume": 0.8, "voice_id": 1},
-                Voice.FEMALE_MATURE: {"rate": 170, "volume": 0.8, "voice_id": 1}
-            }
-            
-            config = voice_configs.get(voice, voice_configs[Voice.MALE_MEDIUM])
-            
-            # Set voice properties
-            engine.setProperty('rate', config["rate"])
-            engine.setProperty('volume', config["volume"])
-            
-            # Try to set specific voice if available
-            voices = engine.getProperty('voices')
-            if voices and len(voices) > config["voice_id"]:
-                engine.setProperty('voice', voices[config["voice_id"]].id)
-            
-            # Create unique temporary file name to avoid conflicts
-            import uuid
-            temp_filename = f"temp_audio_{uuid.uuid4().hex}.wav"
-            temp_path = os.path.join(tempfile.gettempdir(), temp_filename)
-            
-            engine.save_to_file(text, temp_path)
-            engine.runAndWait()
-            
-            # Read the generated audio file
-            with open(temp_path, 'rb') as f:
-                audio_data = f.read()
-            
-            # Clean up temporary file
+        except ImportError:
+            pythoncom = None
+        temp_path = os.path.join(tempfile.gettempdir(), f"echoverse_engine_{os.getpid()}_{index}.wav")
+        try:
+            engines, installed = self._create_engines()
+            startup_error = None
+            print(f"✅ TTS engine worker {index} ready with {len(engines)} voices")
+        except Exception as e:
+            engines, installed = {}, []
+            startup_error = e
+            print(f"❌ TTS engine worker {index} failed to start: {e}")
+        try:
+            while True:
+                request = self._requests.get()
+                if request is None:
+                    break
+                text, voice, future = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if startup_error is not None:
+                    future.set_exception(startup_error)
+                    continue
+                try:
+                    engine = engines[voice]
+                    if not ENGINE_PER_VOICE:
+                        # The one espeak engine takes this request's voice settings first
+                        EnginePool._configure(engine, voice, installed)
+                    engine.save_to_file(text, temp_path)
+                    engine.runAndWait()
+                    with open(temp_path, 'rb') as f:
+                        future.set_result(f.read())
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
             try:
                 os.unlink(temp_path)
-            except:
-                pass  # Ignore cleanup errors
-            
-            pythoncom.CoUninitialize()
-            
-            print(f"✅ Real speech generated! {len(audio_data)} bytes")
+            except OSError:
+                pass
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+class HistoryStore:
+    """Narrations spilled to SQLite so sessions only hold small HistoryEntry records"""
+
+    def __init__(self, path: str, session_limit: int, max_bytes: int):
+        self.path = path
+        self.session_limit = session_limit
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with sqlite_connection(path) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS narrations (
+                id TEXT PRIMARY KEY, session_id TEXT NOT NULL, original_text TEXT NOT NULL,
+                rewritten_text TEXT NOT NULL, tone TEXT NOT NULL, voice TEXT NOT NULL,
+                created REAL NOT NULL, audio_key TEXT NOT NULL, timings TEXT, segments TEXT, dialogue INTEGER NOT NULL, upload TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS narrations_session ON narrations (session_id, created)")
+            conn.execute("CREATE INDEX IF NOT EXISTS narrations_audio_key ON narrations (audio_key)")
+            # Audio is kept once per content hash. The blob is the last column so SQLite can reserve it with
+            # zeroblob() instead of building it in memory.
+            conn.execute("CREATE TABLE IF NOT EXISTS audio (audio_key TEXT PRIMARY KEY, size INTEGER NOT NULL, data BLOB NOT NULL)")
+
+    def add(self, session_id: str, narration: Narration) -> HistoryEntry:
+        """Save a narration, copying its audio from the audio cache into the database block by block"""
+        with open(get_audio_cache().path_for(narration.audio_key), 'rb') as audio, sqlite_connection(self.path) as conn:
+            conn.execute("""INSERT OR REPLACE INTO narrations (id, session_id, original_text, rewritten_text, tone, voice,
+                            created, audio_key, timings, segments, dialogue, upload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                         (narration.id, session_id, narration.original_text, narration.rewritten_text,
+                          narration.tone.name, narration.voice.name, narration.timestamp.timestamp(), narration.audio_key,
+                          json.dumps(narration.timings, separators=(',', ':')) if narration.timings else None,
+                          json.dumps(narration.segments, ensure_ascii=False) if narration.segments else None, int(narration.dialogue), narration.upload))
+            if conn.execute("SELECT 1 FROM audio WHERE audio_key = ?", (narration.audio_key,)).fetchone() is None:
+                audio_size = os.fstat(audio.fileno()).st_size
+                if SQLITE_BLOB_IO:
+                    rowid = conn.execute("INSERT INTO audio (audio_key, size, data) VALUES (?, ?, zeroblob(?))",
+                                         (narration.audio_key, audio_size, audio_size)).lastrowid
+                    with conn.blobopen('audio', 'data', rowid) as blob:
+                        for block in iter(lambda: audio.read(ENCODE_BLOCK_SIZE), b""):
+                            blob.write(block)
+                else:
+                    conn.execute("INSERT INTO audio (audio_key, size, data) VALUES (?, ?, ?)", (narration.audio_key, audio_size, audio.read()))
+            # Per-session cap first, then the global byte budget across all sessions
+            conn.execute("DELETE FROM narrations WHERE session_id = ? AND id NOT IN (SELECT id FROM narrations WHERE session_id = ? ORDER BY created DESC LIMIT ?)",
+                         (session_id, session_id, self.session_limit))
+            conn.execute("DELETE FROM audio WHERE audio_key NOT IN (SELECT audio_key FROM narrations)")
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM audio").fetchone()[0]
+            if total > self.max_bytes:
+                # Shared audio is only freed along with the last narration that uses it
+                references = dict(conn.execute("SELECT audio_key, COUNT(*) FROM narrations GROUP BY audio_key"))
+                sizes = dict(conn.execute("SELECT audio_key, size FROM audio"))
+                doomed, freed = [], 0
+                for row_id, audio_key in conn.execute("SELECT id, audio_key FROM narrations WHERE id != ? ORDER BY created", (narration.id,)):
+                    if total - freed <= self.max_bytes:
+                        break
+                    doomed.append((row_id,))
+                    references[audio_key] -= 1
+                    if references[audio_key] == 0:
+                        freed += sizes.get(audio_key, 0)
+                conn.executemany("DELETE FROM narrations WHERE id = ?", doomed)
+                conn.execute("DELETE FROM audio WHERE audio_key NOT IN (SELECT audio_key FROM narrations)")
+        preview = f"📄 {narration.upload}" if narration.upload else narration.original_text[:100]
+        return HistoryEntry(id=narration.id, preview=preview, tone=narration.tone,
+                            voice=narration.voice, timestamp=narration.timestamp)
+
+    def load(self, narration_id: str):
+        """Load a narration's text, restoring its audio to the audio cache if it was evicted there"""
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute("SELECT original_text, rewritten_text, tone, voice, created, audio_key, timings, segments, dialogue, upload FROM narrations WHERE id = ?",
+                               (narration_id,)).fetchone()
+            if row is None:
+                return None
+            original_text, rewritten_text, tone, voice, created, audio_key, timings, segments, dialogue, upload = row
+            self._restore_audio(conn, audio_key)
+        return Narration(id=narration_id, original_text=original_text, rewritten_text=rewritten_text,
+                         tone=Tone[tone], voice=Voice[voice], timestamp=datetime.fromtimestamp(created), audio_key=audio_key,
+                         timings=json.loads(timings) if timings else None, segments=json.loads(segments) if segments else None,
+                         dialogue=bool(dialogue), upload=upload)
+
+    def restore_audio(self, audio_key: str) -> bool:
+        """Put a narration's audio back in the audio cache from whichever session saved it; False if none did"""
+        with sqlite_connection(self.path) as conn:
+            return self._restore_audio(conn, audio_key)
+
+    @staticmethod
+    def _restore_audio(conn, audio_key: str) -> bool:
+        cache = get_audio_cache()
+        if cache.touch(audio_key):
+            return True
+        if not SQLITE_BLOB_IO:
+            row = conn.execute("SELECT data FROM audio WHERE audio_key = ?", (audio_key,)).fetchone()
+            if row is None:
+                return False
+            cache.put_stream(audio_key, [row[0]])
+            return True
+        row = conn.execute("SELECT rowid FROM audio WHERE audio_key = ?", (audio_key,)).fetchone()
+        if row is None:
+            return False
+        # Stream the blob out in blocks rather than materializing the whole narration
+        with conn.blobopen('audio', 'data', row[0], readonly=True) as blob:
+            cache.put_stream(audio_key, iter(lambda: blob.read(ENCODE_BLOCK_SIZE), b""))
+        return True
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    return HistoryStore(os.path.join(CACHE_DIR, 'history.sqlite3'), HISTORY_SESSION_LIMIT, HISTORY_MAX_BYTES)
+
+class NarrationStore:
+    """Finished narrations and segments indexed by (text hash, tone, voice, engine), shared across sessions and processes
+
+    Rows only point at content-addressed AudioCache keys, so identical audio is stored once however many
+    narrations use it.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_narrations: int, max_segments: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_narrations = max_narrations
+        self.max_segments = max_segments
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with sqlite_connection(path) as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS narrations (
+                text_hash TEXT NOT NULL, tone TEXT NOT NULL, voice TEXT NOT NULL, engine TEXT NOT NULL,
+                rewritten_text TEXT NOT NULL, audio_key TEXT NOT NULL, timings TEXT, segments TEXT,
+                created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (text_hash, tone, voice, engine))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS segments (
+                source_hash TEXT NOT NULL, tone TEXT NOT NULL, voice TEXT NOT NULL, engine TEXT NOT NULL,
+                text TEXT NOT NULL, audio_key TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL,
+                PRIMARY KEY (source_hash, tone, voice, engine))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS narrations_accessed ON narrations (accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS segments_accessed ON segments (accessed)")
+
+    @staticmethod
+    def hashing(paragraphs, digest):
+        """Pass paragraphs through while feeding them to digest, so a text is hashed without being held whole"""
+        for paragraph in paragraphs:
+            digest.update(paragraph.encode('utf-8') + b"\n\n")
+            yield paragraph
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        digest = hashlib.sha256()
+        for _ in NarrationStore.hashing(iter_paragraphs([text]), digest):
+            pass
+        return digest.hexdigest()
+
+    def find_narration(self, text_hash: str, tone: Tone, voice: Voice, engine: str):
+        """Return the stored narration of this exact text as a dict, or None"""
+        now = time.time()
+        key = (text_hash, tone.name, voice.name, engine)
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute("""SELECT rewritten_text, audio_key, timings, segments FROM narrations
+                                  WHERE text_hash = ? AND tone = ? AND voice = ? AND engine = ? AND created > ?""",
+                               key + (now - self.ttl_seconds,)).fetchone()
+            if row:
+                conn.execute("UPDATE narrations SET accessed = ? WHERE text_hash = ? AND tone = ? AND voice = ? AND engine = ?", (now,) + key)
+        get_metrics().increment("narration_store_lookups", kind="narration", result="hit" if row else "miss")
+        if row is None:
+            return None
+        rewritten_text, audio_key, timings, segments = row
+        return {"rewritten_text": rewritten_text, "audio_key": audio_key,
+                "timings": json.loads(timings) if timings else None, "segments": json.loads(segments) if segments else None}
+
+    def find_segments(self, source_hashes: list, tone: Tone, voice: Voice, engine: str) -> dict:
+        """Return {source hash: (rewritten_text, audio_key)} for the segments any session has already narrated"""
+        now = time.time()
+        source_hashes = list(dict.fromkeys(source_hashes))
+        found = {}
+        with sqlite_connection(self.path) as conn:
+            for start in range(0, len(source_hashes), SQLITE_MAX_PARAMS):
+                batch = source_hashes[start:start + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(f"""SELECT source_hash, text, audio_key FROM segments
+                                        WHERE tone = ? AND voice = ? AND engine = ? AND created > ? AND source_hash IN ({placeholders})""",
+                                    [tone.name, voice.name, engine, now - self.ttl_seconds] + batch).fetchall()
+                found.update((source_hash, (text, audio_key)) for source_hash, text, audio_key in rows)
+            conn.executemany("UPDATE segments SET accessed = ? WHERE source_hash = ? AND tone = ? AND voice = ? AND engine = ?",
+                             [(now, source_hash, tone.name, voice.name, engine) for source_hash in found])
+        get_metrics().increment("narration_store_lookups", len(found), kind="segment", result="hit")
+        get_metrics().increment("narration_store_lookups", len(source_hashes) - len(found), kind="segment", result="miss")
+        return found
+
+    def put(self, text_hash: str, narration: Narration, engine: str):
+        now = time.time()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("""INSERT OR REPLACE INTO narrations (text_hash, tone, voice, engine, rewritten_text, audio_key,
+                            timings, segments, created, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                         (text_hash, narration.tone.name, narration.voice.name, engine, narration.rewritten_text, narration.audio_key,
+                          json.dumps(narration.timings, separators=(',', ':')) if narration.timings else None,
+                          json.dumps(narration.segments, ensure_ascii=False) if narration.segments else None, now, now))
+            conn.executemany("""INSERT OR REPLACE INTO segments (source_hash, tone, voice, engine, text, audio_key, created, accessed)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                             [(segment["source"], narration.tone.name, narration.voice.name, engine, segment["text"], segment["audio_key"], now, now)
+                              for segment in narration.segments or [] if segment["audio_key"]])
+            for table, limit in (("narrations", self.max_narrations), ("segments", self.max_segments)):
+                conn.execute(f"DELETE FROM {table} WHERE created <= ?", (now - self.ttl_seconds,))
+                conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (limit,))
+
+@st.cache_resource
+def get_narration_store() -> NarrationStore:
+    return NarrationStore(os.path.join(CACHE_DIR, 'narrations.sqlite3'), NARRATION_STORE_TTL_SECONDS,
+                          NARRATION_STORE_MAX_NARRATIONS, NARRATION_STORE_MAX_SEGMENTS)
+
+class TTSBackend:
+    """An offline speech engine; probe() runs once at startup to decide whether it can be used"""
+    name = "base"
+
+    def probe(self):
+        audio_data = self.synthesize("Ready.", Voice.MALE_MEDIUM)
+        if not audio_data.startswith(b"RIFF"):
+            raise RuntimeError(f"{self.name} did not produce WAV audio")
+
+    def synthesize(self, text: str, voice: Voice) -> bytes:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class EspeakBackend(TTSBackend):
+    """espeak-ng (or classic espeak) run as a subprocess, one process per request"""
+    name = "espeak-ng"
+
+    def __init__(self):
+        self.executable = shutil.which('espeak-ng') or shutil.which('espeak')
+        if not self.executable:
+            raise RuntimeError("espeak-ng is not installed")
+
+    def synthesize(self, text: str, voice: Voice) -> bytes:
+        config = voice_config(voice)
+        command = [self.executable, '--stdout', '--stdin',
+                   '-v', ESPEAK_VOICES.get(voice, 'en'),
+                   '-s', str(config["rate"]),
+                   '-a', str(int(config["volume"] * 100))]
+        result = subprocess.run(command, input=text.encode('utf-8'), capture_output=True, timeout=ESPEAK_TIMEOUT_SECONDS, check=True)
+        # espeak streams a header with placeholder sizes; rewrite it with the real ones
+        with wave.open(io.BytesIO(result.stdout), 'rb') as wav_in:
+            params = wav_in.getparams()
+            frames = wav_in.readframes(wav_in.getnframes())
+        wav_buffer = io.BytesIO()
+        with wave.open(wav_buffer, 'wb') as wav_out:
+            wav_out.setnchannels(params.nchannels)
+            wav_out.setsampwidth(params.sampwidth)
+            wav_out.setframerate(params.framerate)
+            wav_out.writeframes(frames)
+        return wav_buffer.getvalue()
+
+class Pyttsx3Backend(TTSBackend):
+    """pyttsx3 (SAPI5 on Windows, NSSpeech on macOS, espeak elsewhere) behind the engine pool"""
+    name = "pyttsx3"
+
+    def __init__(self):
+        self.pool = EnginePool(ENGINE_POOL_WORKERS)
+
+    def probe(self):
+        audio_data = self.pool.synthesize("Ready.", Voice.MALE_MEDIUM, timeout=PROBE_TIMEOUT_SECONDS)
+        if not audio_data.startswith(b"RIFF"):
+            raise RuntimeError("pyttsx3 did not produce WAV audio")
+
+    def synthesize(self, text: str, voice: Voice) -> bytes:
+        return self.pool.synthesize(text, voice)
+
+    def close(self):
+        self.pool.close()
+
+class ToneBackend(TTSBackend):
+    """The sine-wave placeholder; always available, used only when no real engine works"""
+    name = "tone"
+
+    def synthesize(self, text: str, voice: Voice) -> bytes:
+        return TTSService.create_speech_fallback(text, voice)
+
+# Real engines, tried in this order; the fastest one that passes its probe wins
+TTS_BACKENDS = [EspeakBackend, Pyttsx3Backend]
+
+def select_tts_backend() -> TTSBackend:
+    requested = os.environ.get('ECHOVERSE_TTS_BACKEND')
+    candidates = []
+    for backend_class in TTS_BACKENDS:
+        if requested and backend_class.name != requested:
+            continue
+        backend = None
+        try:
+            started = time.perf_counter()
+            backend = backend_class()
+            backend.probe()
+            elapsed = time.perf_counter() - started
+            print(f"✅ TTS backend {backend.name} available (probe {elapsed * 1000:.0f} ms)")
+            candidates.append((elapsed, backend))
+        except Exception as e:
+            print(f"TTS backend {backend_class.name} unavailable: {e}")
+            if backend is not None:
+                backend.close()
+    if not candidates:
+        print("❌ No speech engine available, using tone fallback")
+        return ToneBackend()
+    candidates.sort(key=lambda candidate: candidate[0])
+    for _, backend in candidates[1:]:
+        backend.close()
+    return candidates[0][1]
+
+@st.cache_resource
+def get_tts_backend() -> TTSBackend:
+    return select_tts_backend()
+
+def number_words(n: int) -> str:
+    if n < 20:
+        return NUMBER_ONES[n]
+    if n < 100:
+        return NUMBER_TENS[n // 10] + ("-" + NUMBER_ONES[n % 10] if n % 10 else "")
+    if n < 1000:
+        return NUMBER_ONES[n // 100] + " hundred" + (" " + number_words(n % 100) if n % 100 else "")
+    if n >= 1000 ** len(NUMBER_SCALES):
+        return " ".join(NUMBER_ONES[int(digit)] for digit in str(n))
+    groups = []
+    for scale in NUMBER_SCALES:
+        n, group = divmod(n, 1000)
+        if group:
+            groups.append(number_words(group) + (" " + scale if scale else ""))
+    return " ".join(reversed(groups))
+
+def ordinal_words(n: int) -> str:
+    words = number_words(n)
+    split = max(words.rfind(" "), words.rfind("-")) + 1
+    last = words[split:]
+    return words[:split] + (ORDINAL_WORDS.get(last) or (last[:-1] + "ieth" if last.endswith("y") else last + "th"))
+
+def decimal_words(text: str) -> str:
+    whole, _, fraction = text.replace(",", "").partition(".")
+    words = number_words(int(whole))
+    return words + " point " + " ".join(NUMBER_ONES[int(digit)] for digit in fraction) if fraction else words
+
+def year_words(text: str) -> str:
+    """Read like a year: nineteen ninety-nine, two thousand five, twenty twenty-four; a decade like 1990s is nineteen nineties"""
+    n = int(text[:4])
+    high, low = divmod(n, 100)
+    if 2000 <= n < 2010:
+        words = number_words(n)
+    else:
+        words = number_words(high) + (" hundred" if low == 0 else " oh " + number_words(low) if low < 10 else " " + number_words(low))
+    if not text.endswith("s"):
+        return words
+    return words[:-1] + "ies" if words.endswith("y") else words + "s"
+
+def spoken_form(match, kind: str = None) -> str:
+    kind = kind or match.lastgroup
+    spoken = spoken_words(kind, match.group())
+    if kind in ("money", "time", "ordinal", "percent", "year", "number"):
+        # Keep digits glued to letters (mp3, 3D) from becoming one word
+        string, start, end = match.string, match.start(), match.end()
+        if start and string[start - 1].isalpha():
+            spoken = " " + spoken
+        if end < len(string) and string[end].isalpha():
+            spoken += " "
+    return spoken
+
+def spoken_words(kind: str, text: str) -> str:
+    if kind in ("prefix", "emoji"):
+        return ""
+    if kind == "markup":
+        return " " if text.startswith("_") else ""
+    if kind == "link":
+        return text[1:text.index("](")]
+    if kind == "money":
+        one, many, small_one, small_many = CURRENCIES[text[0]]
+        whole, _, fraction = text[1:].replace(",", "").partition(".")
+        if len(fraction) > 2:
+            return f"{decimal_words(text[1:])} {many}"
+        units, cents = int(whole), int(fraction.ljust(2, "0")) if fraction else 0
+        spoken_units = f"{number_words(units)} {one if units == 1 else many}"
+        spoken_cents = f"{number_words(cents)} {small_one if cents == 1 else small_many}"
+        if not cents:
+            return spoken_units
+        return f"{spoken_units} and {spoken_cents}" if units else spoken_cents
+    if kind == "time":
+        hours, minutes = (int(part) for part in text.split(":"))
+        if minutes == 0:
+            return f"{number_words(hours)} o'clock"
+        return f"{number_words(hours)} {'oh ' if minutes < 10 else ''}{number_words(minutes)}"
+    if kind == "ordinal":
+        return ordinal_words(int(text[:-2]))
+    if kind == "percent":
+        return decimal_words(text[:-1]) + " percent"
+    if kind == "year":
+        return year_words(text)
+    if kind == "number":
+        return decimal_words(text)
+    if kind == "abbreviation":
+        return ABBREVIATIONS[text]
+    return PRONUNCIATIONS[text]
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SENTENCES)
+def normalize_sentence(sentence: str) -> str:
+    return SPOKEN_FORMS.sub(spoken_form, sentence)
+
+def normalize_for_speech(text: str) -> str:
+    """The words the speech engine should say for text; one scan, memoized per sentence so regenerations are free"""
+    parts, start = [], 0
+    for match in SENTENCE_BREAK.finditer(text):
+        parts.append(normalize_sentence(text[start:match.start()]))
+        parts.append(match.group())
+        start = match.end()
+    parts.append(normalize_sentence(text[start:]))
+    return "".join(parts)
+
+class TTSService:
+    @staticmethod
+    def generate_audio(text: str, voice: Voice, on_fallback=None) -> bytes:
+        """WAV bytes for text; when the engine fails, placeholder tones, with on_fallback(engine name) called"""
+        backend = get_tts_backend()
+        cache = get_audio_cache()
+        # Keyed on what is actually spoken, so texts that only differ in markup share audio
+        spoken = normalize_for_speech(text)
+        key = AudioCache.make_key(spoken, voice, voice_config(voice), engine=backend.name)
+        audio_data = cache.get(key)
+        if audio_data is not None:
+            print(f"⚡ Audio cache hit for voice: {voice.value}")
             return audio_data
-                
+        metrics = get_metrics()
+        try:
+            print(f"🎤 Generating speech with {backend.name} for voice: {voice.value}")
+            with metrics.span("synthesize", backend=backend.name):
+                audio_data = backend.synthesize(spoken, voice)
         except Exception as e:
-            print(f"Real speech generation error: {e}")
-            try:
-                pythoncom.CoUninitialize()
-            except:
-                pass
+            # A one-off engine failure is not cached, so the next request retries the real engine
+            print(f"❌ TTS Error ({backend.name}): {e}")
+            metrics.increment("tts_fallbacks", backend=backend.name)
+            if on_fallback:
+                on_fallback(backend.name)
             return TTSService.create_speech_fallback(text, voice)
+        metrics.record_bytes("synthesized_audio", len(audio_data), backend=backend.name)
+        if audio_data:
+            try:
+                cache.put(key, audio_data)
+            except OSError as e:
+                print(f"Audio cache write error: {e}")
+        return audio_data
     
-    
+    @staticmethod
+    def render_fallback_pcm(text: str, base_freq: int, sample_rate: int, duration: float) -> array:
+        """Render the fallback waveform into a preallocated int16 buffer, block by block"""
+        total = int(sample_rate * duration)
+        pcm = array('h', bytes(2 * total))
+        if not total:
+            return pcm
+        # Per-character phase step; 2 * pi * f is the left-most product of the
+        # original per-sample expression, so hoisting it keeps results bit-exact
+        steps = cycle([2 * math.pi * (base_freq + (ord(ch) % 50)) for ch in text])
+        envelope = TTSService.fallback_envelope(sample_rate, duration)
+        sin = math.sin
+        for start in range(0, total, FALLBACK_BLOCK_SIZE):
+            stop = min(start + FALLBACK_BLOCK_SIZE, total)
+            pcm[start:stop] = array('h', [
+                int(envelope[i] * sin(step * i / sample_rate))
+                for i, step in zip(range(start, stop), steps)
+            ])
+        return pcm
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def fallback_envelope(sample_rate: int, duration: float) -> array:
+        """Scaled amplitude envelope; long texts all share the 8 second one"""
+        span = sample_rate * duration
+        sin, pi = math.sin, math.pi
+        return array('d', [32767 * (0.3 * sin(pi * i / span)) for i in range(int(span))])
+
     @staticmethod
     def create_speech_fallback(text: str, voice: Voice) -> bytes:
+        with get_metrics().span("fallback_synthesis"):
+            return TTSService._create_speech_fallback(text, voice)
+
+    @staticmethod
+    def _create_speech_fallback(text: str, voice: Voice) -> bytes:
         try:
             sample_rate = 22050
             duration = min(len(text) * 0.1, 8)
@@ -188,14 +2206,10 @@ class TTSService:
             }
             
             base_freq = fallback_freqs.get(voice, 120)
-            samples = []
-            for i in range(int(sample_rate * duration)):
-                char_index = i % len(text) if text else 0
-                frequency = base_freq + (ord(text[char_index]) % 50)
-                envelope = 0.3 * math.sin(math.pi * i / (sample_rate * duration))
-                sample = int(32767 * envelope * math.sin(2 * math.pi * frequency * i / sample_rate))
-                samples.append(sample)
-            audio_data = struct.pack('<' + 'h' * len(samples), *samples)
+            pcm = TTSService.render_fallback_pcm(text, base_freq, sample_rate, duration)
+            if sys.byteorder == 'big':
+                pcm.byteswap()
+            audio_data = pcm.tobytes()
             wav_buffer = io.BytesIO()
             with wave.open(wav_buffer, 'wb') as wav_file:
                 wav_file.setnchannels(1)
@@ -208,8 +2222,625 @@ class TTSService:
             print(f"Fallback error: {e}")
             return b""
 
-def render_header():
-    st.markdown("""
+def detect_encoding(sample: bytes) -> str:
+    """Guess a text encoding from the first block: BOM, then strict UTF-8, then charset_normalizer if installed"""
+    for bom, encoding in TEXT_BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        import charset_normalizer
+    except ImportError:
+        return 'cp1252'
+    match = charset_normalizer.from_bytes(sample).best()
+    return match.encoding if match is not None else 'cp1252'
+
+def iter_decoded(stream, block_size: int = INGEST_BLOCK_SIZE):
+    """Decode a binary stream incrementally, yielding text blocks"""
+    block = stream.read(block_size)
+    decoder = codecs.getincrementaldecoder(detect_encoding(block))(errors='replace')
+    while block:
+        text = decoder.decode(block)
+        if text:
+            yield text
+        block = stream.read(block_size)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def iter_paragraphs(blocks, clean=None, max_chars: int = INGEST_MAX_PARAGRAPH_CHARS):
+    """Yield whitespace-normalized paragraphs from text blocks, holding back only the unfinished one"""
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        parts = PARAGRAPH_BREAK.split(buffer)
+        buffer = parts.pop()
+        while len(buffer) > max_chars:
+            cut = buffer.rfind('\n', 0, max_chars)
+            if cut <= 0:
+                sentence_ends = [match.end() for match in SENTENCE_BREAK.finditer(buffer, 0, max_chars)]
+                cut = sentence_ends[-1] if sentence_ends else buffer.rfind(' ', 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            parts.append(buffer[:cut])
+            buffer = buffer[cut:]
+        for part in parts:
+            paragraph = ' '.join((clean(part) if clean else part).split())
+            if paragraph:
+                yield paragraph
+    paragraph = ' '.join((clean(buffer) if clean else buffer).split())
+    if paragraph:
+        yield paragraph
+
+def strip_markdown(text: str) -> str:
+    return MARKDOWN_MARKUP.sub(lambda match: match.group(1) or "", text)
+
+class EpubTextParser(HTMLParser):
+    """Collects the text of an XHTML chapter, one paragraph per block element"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self._parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in EPUB_SKIP_TAGS:
+            self._skipping += 1
+        elif tag in EPUB_BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in EPUB_SKIP_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in EPUB_BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._parts.append(data)
+
+    def _flush(self):
+        paragraph = ' '.join(''.join(self._parts).split())
+        self._parts = []
+        if paragraph:
+            self.paragraphs.append(paragraph)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+def epub_spine(archive: zipfile.ZipFile) -> list:
+    """Chapter paths inside an EPUB in reading order"""
+    def local(tag):
+        return tag.rsplit('}', 1)[-1]
+    container = ElementTree.fromstring(archive.read('META-INF/container.xml'))
+    opf_path = next(el.get('full-path') for el in container.iter() if local(el.tag) == 'rootfile')
+    package = ElementTree.fromstring(archive.read(opf_path))
+    manifest = {el.get('id'): el.get('href') for el in package.iter() if local(el.tag) == 'item'}
+    base = posixpath.dirname(opf_path)
+    return [posixpath.normpath(posixpath.join(base, manifest[el.get('idref')]))
+            for el in package.iter() if local(el.tag) == 'itemref' and el.get('idref') in manifest]
+
+def iter_epub_paragraphs(stream):
+    with zipfile.ZipFile(stream) as archive:
+        for path in epub_spine(archive):
+            parser = EpubTextParser()
+            with archive.open(path) as chapter:
+                for block in iter_decoded(chapter):
+                    parser.feed(block)
+                    yield from parser.paragraphs
+                    parser.paragraphs = []
+            parser.close()
+            yield from parser.paragraphs
+
+def ingest_paragraphs(stream, filename: str):
+    """Stream normalized paragraphs out of an uploaded .txt, .md or .epub file without decoding it whole"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.epub':
+        return iter_epub_paragraphs(stream)
+    if extension in ('.md', '.markdown'):
+        return iter_paragraphs(iter_decoded(stream), strip_markdown)
+    return iter_paragraphs(iter_decoded(stream))
+
+def leading_paragraphs(paragraphs, max_chars: int = UPLOAD_PREVIEW_CHARS) -> str:
+    """The opening paragraphs of a text, up to about max_chars, without reading the rest"""
+    leading, size = [], 0
+    for paragraph in paragraphs:
+        if leading and size + len(paragraph) > max_chars:
+            break
+        leading.append(paragraph[:max_chars])
+        size += len(paragraph) + 2
+    return "\n\n".join(leading)
+
+@dataclass
+class TextChunk:
+    index: int
+    text: str
+    separator: str
+
+def chunk_paragraphs(paragraphs, max_chars: int = CHUNK_MAX_CHARS):
+    """Yield paragraph-aligned chunks of whole sentences, each at most max_chars long, as paragraphs arrive"""
+    index = 0
+    for paragraph in paragraphs:
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        pieces = []
+        current = ""
+        for sentence in SENTENCE_BREAK.split(paragraph):
+            # A single sentence longer than the limit is cut on word boundaries
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(' ', 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                if current:
+                    pieces.append(current)
+                    current = ""
+                pieces.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                pieces.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            pieces.append(current)
+        for i, piece in enumerate(pieces):
+            yield TextChunk(index=index, text=piece, separator="\n\n" if i == len(pieces) - 1 else " ")
+            index += 1
+
+def split_into_chunks(text: str, max_chars: int = CHUNK_MAX_CHARS) -> list:
+    """Split text into paragraph-aligned chunks of whole sentences, each at most max_chars long"""
+    return list(chunk_paragraphs(PARAGRAPH_BREAK.split(text), max_chars))
+
+def join_chunks(chunks: list, texts: list) -> str:
+    """Reassemble per-chunk texts with the original paragraph breaks"""
+    return ''.join(text + chunk.separator for chunk, text in zip(chunks, texts)).strip()
+
+def build_timing_map(texts: list, durations: list) -> dict:
+    """Word start times (ms) and sentence-start word indices for the text join_chunks produces from texts
+
+    Each chunk's measured audio duration is spread over its words by length, with
+    extra weight for the pause after punctuation, so drift never crosses a chunk.
+    """
+    words, sentences = [], [0]
+    offset = 0.0
+    for text, duration in zip(texts, durations):
+        chunk_words = text.split()
+        weights = []
+        for word in chunk_words:
+            pause = SENTENCE_PAUSE_WEIGHT if SENTENCE_END.search(word) else CLAUSE_PAUSE_WEIGHT if CLAUSE_END.search(word) else 0
+            weights.append(len(word) + 1 + pause)
+        total = sum(weights) or 1
+        elapsed = 0
+        for word, weight in zip(chunk_words, weights):
+            words.append(round((offset + duration * elapsed / total) * 1000))
+            elapsed += weight
+            if SENTENCE_END.search(word):
+                sentences.append(len(words))
+        offset += duration
+    if sentences[-1] >= len(words):
+        sentences.pop()
+    return {"words": words, "sentences": sentences, "duration": round(offset * 1000)}
+
+def split_dialogue(text: str, recent=()) -> list:
+    """[(speaker, text)] in reading order, in one scan; speaker is None for the narrator and "" for an unnamed character
+
+    recent holds the speakers heard before text, most recent last.
+    """
+    lines, position, recent = [], 0, list(recent)
+    for match in QUOTED_SPEECH.finditer(text):
+        before = text[position:match.start()]
+        tag = SPEAKER_AFTER.match(text, match.end()) or SPEAKER_BEFORE.search(before[-DIALOGUE_TAG_CHARS:])
+        speaker = tag and next(name for name in tag.groups() if name)
+        if not speaker or speaker in SPEAKER_PRONOUNS:
+            if lines and lines[-1][0] is not None:
+                # Another quote in the same passage is the same speaker carrying on
+                speaker = lines[-1][0]
+            else:
+                # Untagged lines in a conversation usually alternate between the last two speakers
+                speaker = recent[-2] if len(recent) >= 2 else ""
+        if speaker and (not recent or recent[-1] != speaker):
+            recent.append(speaker)
+        lines.append((None, before))
+        lines.append((speaker, match.group(1) or match.group(2)))
+        position = match.end()
+    lines.append((None, text[position:]))
+    merged = []
+    for speaker, line in lines:
+        if not line.strip():
+            continue
+        if merged and merged[-1][0] == speaker:
+            merged[-1] = (speaker, merged[-1][1] + " " + line)
+        else:
+            merged.append((speaker, line))
+    return merged
+
+def dialogue_contexts(chunks):
+    """Yield each chunk with the last two speakers heard before it, so untagged replies keep alternating across paragraphs"""
+    recent = []
+    for chunk in chunks:
+        yield chunk, tuple(recent)
+        for speaker, _ in split_dialogue(chunk.text, recent):
+            if speaker and (not recent or recent[-1] != speaker):
+                recent = (recent + [speaker])[-2:]
+
+def speaker_voice(speaker, narrator: Voice) -> Voice:
+    """The narrator's voice for narration, otherwise a voice picked from the speaker's name so it stays the same all book long"""
+    if speaker is None:
+        return narrator
+    voices = [voice for voice in Voice if voice != narrator]
+    digest = hashlib.sha256(speaker.lower().encode('utf-8')).digest()
+    return voices[int.from_bytes(digest[:4], 'big') % len(voices)]
+
+@st.cache_resource
+def get_dialogue_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=DIALOGUE_WORKERS, thread_name_prefix="echoverse-dialogue")
+
+@st.cache_resource
+def get_pipeline_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="echoverse-pipeline")
+
+class NarrationPipeline:
+    @staticmethod
+    def process_chunk(chunk: TextChunk, tone: Tone, voice: Voice, priority: RewritePriority = RewritePriority.INTERACTIVE, speakers: tuple = None, on_fallback=None):
+        """Rewrite and synthesize one chunk into (rewritten_text, audio_key, placeholder)
+
+        speakers, when given, turns on dialogue voices and holds the speakers heard before it. placeholder is
+        True when the speech engine failed and the audio is fallback tones, which must not be reused.
+        """
+        if chunk.index == 0 and priority == RewritePriority.INTERACTIVE:
+            priority = RewritePriority.FIRST_AUDIO
+        rewritten = GeminiService.rewrite_text_with_tone(chunk.text, tone, priority, on_fallback)
+        failed = []
+        if speakers is not None:
+            return rewritten, NarrationPipeline.synthesize_dialogue(rewritten, voice, speakers, failed.append), bool(failed)
+        audio = TTSService.generate_audio(rewritten, voice, failed.append)
+        # Only the cache key travels back, so finished chunks waiting their turn hold no audio in memory
+        return rewritten, get_audio_cache().put_content(audio) if audio else None, bool(failed)
+
+    @staticmethod
+    def synthesize_dialogue(text: str, narrator: Voice, speakers: tuple = (), on_fallback=None):
+        """Audio key for text with each speaker's quoted lines in their own voice; the lines are synthesized in parallel"""
+        lines = split_dialogue(text, speakers)
+        if len(lines) <= 1 and all(speaker is None for speaker, _ in lines):
+            audio = TTSService.generate_audio(text, narrator, on_fallback)
+            return get_audio_cache().put_content(audio) if audio else None
+        executor = get_dialogue_executor()
+        futures = [executor.submit(TTSService.generate_audio, line, speaker_voice(speaker, narrator), on_fallback) for speaker, line in lines]
+        cache = get_audio_cache()
+        # Lines join the chunk's audio in reading order as they finish
+        with WavAssembler(cache) as assembler:
+            for future in futures:
+                audio = future.result()
+                if audio:
+                    assembler.append(cache.put_content(audio))
+            return assembler.finish()
+
+    @staticmethod
+    def plan(text: str, first_chunk_chars: int = None) -> list:
+        return list(NarrationPipeline.plan_paragraphs(PARAGRAPH_BREAK.split(text), first_chunk_chars))
+
+    @staticmethod
+    def plan_paragraphs(paragraphs, first_chunk_chars: int = None):
+        """Yield the chunks to narrate as paragraphs arrive"""
+        chunks = chunk_paragraphs(paragraphs)
+        first = next(chunks, None)
+        if first is None:
+            return
+        head = [first]
+        if first_chunk_chars and len(first.text) > first_chunk_chars:
+            # A short opening chunk gets the first audio out quickly
+            head = split_into_chunks(first.text, first_chunk_chars)
+            head[-1].separator = first.separator
+        for index, chunk in enumerate(chain(head, chunks)):
+            yield TextChunk(index=index, text=chunk.text, separator=chunk.separator)
+
+    @staticmethod
+    def stream(chunks, tone: Tone, voice: Voice, priority: RewritePriority = RewritePriority.INTERACTIVE, reuse=None, dialogue: bool = False, on_fallback=None):
+        """Yield (chunk, rewritten_text, audio_key, placeholder) in document order while later chunks are still in flight
+
+        chunks may be a lazy iterable; at most PIPELINE_MAX_IN_FLIGHT of them are taken ahead of the one being yielded.
+        reuse(chunk), when given, returns an earlier (rewritten_text, audio_key) for the chunk or None.
+        """
+        executor = get_pipeline_executor()
+        # Speaker turns are followed through the original text in order; the rewritten chunks then run in parallel
+        pairs = dialogue_contexts(chunks) if dialogue else zip(chunks, repeat(None))
+        pending = deque()
+        try:
+            for chunk, speakers in pairs:
+                result = reuse(chunk) if reuse else None
+                if result:
+                    future = Future()
+                    future.set_result(result + (False,))
+                else:
+                    future = executor.submit(NarrationPipeline.process_chunk, chunk, tone, voice, priority, speakers, on_fallback)
+                pending.append((chunk, future))
+                if len(pending) >= PIPELINE_MAX_IN_FLIGHT:
+                    chunk, future = pending.popleft()
+                    yield (chunk,) + future.result()
+            while pending:
+                chunk, future = pending.popleft()
+                yield (chunk,) + future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    @staticmethod
+    def source_hash(chunk: TextChunk) -> str:
+        return hashlib.sha256(chunk.text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def reusable(previous: Narration, tone: Tone, voice: Voice, engine: str, dialogue: bool = False):
+        """A reuse(chunk) lookup for stream(): the previous narration's segment for unchanged chunks, else one any session stored"""
+        earlier = {}
+        if previous is not None and previous.segments and previous.tone == tone and previous.voice == voice and previous.dialogue == dialogue:
+            earlier = {segment["source"]: (segment["text"], segment["audio_key"]) for segment in previous.segments}
+        store = get_narration_store()
+
+        def reuse(chunk: TextChunk):
+            source = NarrationPipeline.source_hash(chunk)
+            result = source in earlier and NarrationPipeline._reuse(chunk, *earlier[source], tone)
+            if not result:
+                stored = store.find_segments([source], tone, voice, engine)
+                result = source in stored and NarrationPipeline._reuse(chunk, *stored[source], tone)
+            get_metrics().increment("segments", source="reused" if result else "generated")
+            return result or None
+
+        return reuse
+
+    @staticmethod
+    def _reuse(chunk: TextChunk, text: str, audio_key: str, tone: Tone):
+        """(rewritten_text, audio_key) of an earlier segment, or None when it should be generated again"""
+        # Degraded fallback rewrites get another chance at Gemini
+        if text == GeminiService.simple_rewrite_fallback(chunk.text, tone):
+            return None
+        # Evicted segment audio is simply regenerated
+        if audio_key and not get_audio_cache().touch(audio_key):
+            return None
+        return text, audio_key
+
+    @staticmethod
+    def preview_tones(text: str, tones: list, first_chunk_chars: int = None, on_fallback=None) -> dict:
+        """Rewrite every chunk in every tone with batched requests; later narrations in any of them hit the cache"""
+        chunks = NarrationPipeline.plan(text, first_chunk_chars)
+        rewritten = GeminiService.rewrite_many([(chunk.text, tone) for chunk in chunks for tone in tones], on_fallback=on_fallback)
+        return {tone: join_chunks(chunks, rewritten[i::len(tones)]) for i, tone in enumerate(tones)}
+
+    @staticmethod
+    def run(text: str, tone: Tone, voice: Voice, on_progress=None, priority: RewritePriority = RewritePriority.INTERACTIVE, dialogue: bool = False):
+        """Rewrite and synthesize each chunk on the shared worker pool, stitching the results in order
+
+        Returns (rewritten_text, audio_key); the narration's WAV is in the audio cache.
+        """
+        chunks = NarrationPipeline.plan(text)
+        if not chunks:
+            return "", None
+        with get_metrics().span("pipeline"):
+            return NarrationPipeline._run_chunks(chunks, tone, voice, on_progress, priority, dialogue)
+
+    @staticmethod
+    def _run_chunks(chunks: list, tone: Tone, voice: Voice, on_progress, priority: RewritePriority, dialogue: bool):
+        texts = []
+        with WavAssembler(get_audio_cache()) as assembler:
+            for chunk, rewritten, audio_key, _ in NarrationPipeline.stream(chunks, tone, voice, priority, dialogue=dialogue):
+                texts.append(rewritten)
+                if audio_key:
+                    assembler.append(audio_key)
+                if on_progress:
+                    on_progress(len(texts), len(chunks))
+            return join_chunks(chunks, texts), assembler.finish()
+
+@dataclass
+class Job:
+    id: str
+    user_id: str
+    original_text: str
+    tone: Tone
+    voice: Voice
+    first_chunk_chars: int = None
+    dialogue: bool = False
+    previous: Narration = None
+    # Set for uploads, with the file name in upload; consumed once when the job starts and original_text becomes their opening
+    paragraphs: object = None
+    upload: str = None
+    status: str = "queued"
+    done: int = 0
+    total: int = 0
+    segment_keys: list = field(default_factory=list)
+    segment_seconds: list = field(default_factory=list)
+    # Error categories of passages that fell back to the local rewrite; the page shows them, job threads cannot
+    rewrite_errors: list = field(default_factory=list)
+    narration: Narration = None
+    history_entry: HistoryEntry = None
+    error: str = None
+    created: float = field(default_factory=time.time)
+    started: float = None
+    first_audio_seconds: float = None
+    finished: float = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+class JobManager:
+    """Runs narrations off the Streamlit script thread so reruns can poll them instead of losing them"""
+
+    def __init__(self, workers: int, per_user_limit: int):
+        self.per_user_limit = per_user_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="echoverse-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, user_id: str, original_text: str, tone: Tone, voice: Voice, first_chunk_chars: int = None, previous: Narration = None, paragraphs=None, upload: str = None, dialogue: bool = False) -> str:
+        with self._lock:
+            self._prune_locked()
+            active = sum(1 for job in self._jobs.values() if job.user_id == user_id and job.active)
+            if active >= self.per_user_limit:
+                raise RuntimeError(f"You already have {active} narrations in progress. Please wait for one to finish.")
+            job = Job(id=uuid.uuid4().hex, user_id=user_id, original_text=original_text, tone=tone, voice=voice, first_chunk_chars=first_chunk_chars, dialogue=dialogue, previous=previous, paragraphs=paragraphs, upload=upload)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job.id
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.cancel_event.set()
+        with self._lock:
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished = time.time()
+        return True
+
+    def _prune_locked(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [job.id for job in self._jobs.values() if not job.active and job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job):
+        with self._lock:
+            if job.status != "queued":
+                return
+            job.status = "running"
+            job.started = time.time()
+        try:
+            # Dialogue audio is a different rendering of the same text, so it is indexed apart
+            engine = get_tts_backend().name + ("+dialogue" if job.dialogue else "")
+            digest = None
+            if job.paragraphs is not None:
+                # Uploads are hashed and narrated as they are read; only their opening is kept
+                digest, opening = hashlib.sha256(), []
+
+                def read():
+                    size = 0
+                    for paragraph in NarrationStore.hashing(job.paragraphs, digest):
+                        if size < UPLOAD_PREVIEW_CHARS:
+                            opening.append(paragraph[:UPLOAD_PREVIEW_CHARS - size])
+                            size += len(paragraph) + 2
+                        yield paragraph
+
+                chunks = NarrationPipeline.plan_paragraphs(read(), job.first_chunk_chars)
+            else:
+                chunks = NarrationPipeline.plan(job.original_text, job.first_chunk_chars)
+                job.total = len(chunks)
+                text_hash = NarrationStore.text_hash(job.original_text)
+                if self._finish_from_store(job, text_hash, engine):
+                    return
+            # Only chunks that changed since the previous narration, and that no session has narrated yet, go back through Gemini and TTS
+            reuse = NarrationPipeline.reusable(job.previous, job.tone, job.voice, engine, job.dialogue)
+            job.previous = None
+            parts, texts, durations, records = [], [], [], []
+            degraded = False
+            stream = NarrationPipeline.stream(chunks, job.tone, job.voice, reuse=reuse, dialogue=job.dialogue, on_fallback=job.rewrite_errors.append)
+            with WavAssembler(get_audio_cache()) as assembler:
+                try:
+                    for chunk, rewritten, segment_key, placeholder in stream:
+                        if job.cancel_event.is_set():
+                            break
+                        degraded = degraded or placeholder or rewritten == GeminiService.simple_rewrite_fallback(chunk.text, job.tone)
+                        texts.append(rewritten)
+                        parts.append(rewritten + chunk.separator)
+                        # Each segment goes onto the end of the narration file as soon as it is ready
+                        durations.append(assembler.append(segment_key) if segment_key else 0.0)
+                        if not placeholder:
+                            # Placeholder tones from a failed speech engine are never offered for reuse
+                            records.append({"source": NarrationPipeline.source_hash(chunk), "text": rewritten, "audio_key": segment_key})
+                        if job.first_audio_seconds is None:
+                            job.first_audio_seconds = time.time() - job.started
+                            get_metrics().observe("job_first_audio_seconds", job.first_audio_seconds)
+                        if segment_key:
+                            job.segment_seconds.append(durations[-1])
+                            job.segment_keys.append(segment_key)
+                        job.done = len(texts)
+                finally:
+                    # Closing the generator cancels chunks that have not started yet
+                    stream.close()
+                    job.paragraphs = None
+                if job.cancel_event.is_set():
+                    job.status = "cancelled"
+                    return
+                audio_key = assembler.finish()
+            if digest is not None:
+                text_hash = digest.hexdigest()
+                job.original_text = "\n\n".join(opening)[:UPLOAD_PREVIEW_CHARS]
+                job.total = job.done
+            rewritten_text = ''.join(parts).strip()
+            if not rewritten_text or not audio_key:
+                raise RuntimeError("Failed to generate audiobook. Please try again.")
+            job.narration = Narration(id=self._narration_id(job), original_text=job.original_text, rewritten_text=rewritten_text, tone=job.tone, voice=job.voice, timestamp=datetime.now(), audio_key=audio_key,
+                                      timings=build_timing_map(texts, durations), segments=records, dialogue=job.dialogue, upload=job.upload)
+            job.history_entry = get_history_store().add(job.user_id, job.narration)
+            if not degraded:
+                try:
+                    get_narration_store().put(text_hash, job.narration, engine)
+                except sqlite3.Error as e:
+                    print(f"Narration store write error: {e}")
+            job.status = "done"
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            get_metrics().observe("job_seconds", job.finished - job.started, status=job.status)
+            get_metrics().increment("jobs", status=job.status)
+
+    @staticmethod
+    def _narration_id(job: Job) -> str:
+        return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job.id[:8]}"
+
+    @staticmethod
+    def _finish_from_store(job: Job, text_hash: str, engine: str) -> bool:
+        """Complete the job with the narration another session already made of the same text, if its audio is still around"""
+        stored = get_narration_store().find_narration(text_hash, job.tone, job.voice, engine)
+        if stored is None or not get_history_store().restore_audio(stored["audio_key"]):
+            return False
+        job.done = job.total
+        job.first_audio_seconds = time.time() - job.started
+        get_metrics().observe("job_first_audio_seconds", job.first_audio_seconds)
+        get_metrics().increment("segments", job.total, source="stored")
+        job.narration = Narration(id=JobManager._narration_id(job), original_text=job.original_text, rewritten_text=stored["rewritten_text"], tone=job.tone, voice=job.voice, timestamp=datetime.now(),
+                                  audio_key=stored["audio_key"], timings=stored["timings"], segments=stored["segments"], dialogue=job.dialogue)
+        job.history_entry = get_history_store().add(job.user_id, job.narration)
+        job.status = "done"
+        return True
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    return JobManager(JOB_WORKERS, JOB_USER_LIMIT)
+
+@st.cache_resource
+def start_services() -> Future:
+    """Probe TTS backends and open the stores on a background thread so the first page renders straight away"""
+    future = Future()
+
+    def warm_up():
+        try:
+            get_history_store()
+            get_narration_store()
+            get_media_server()
+            get_metrics_server()
+            future.set_result(get_tts_backend())
+        except Exception as e:
+            print(f"❌ Service start-up failed: {e}")
+            future.set_exception(e)
+
+    threading.Thread(target=warm_up, name="echoverse-warmup", daemon=True).start()
+    return future
+
+HEADER_HTML = """
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;600;700&display=swap');
     
@@ -382,6 +3013,18 @@ def render_header():
         animation: fadeInUp 0.8s ease-out;
     }
     
+    .download-link {
+        display: block;
+        text-align: center;
+        padding: 0.5rem 1rem;
+        border-radius: 0.5rem;
+        background: linear-gradient(135deg, #667eea, #764ba2);
+        color: white !important;
+        text-decoration: none !important;
+        font-weight: 600;
+        margin-top: 1.6rem;
+    }
+    
     .control-slider {
         background: linear-gradient(90deg, #667eea, #764ba2);
         border-radius: 10px;
@@ -418,57 +3061,64 @@ def render_header():
             <p class="main-subtitle">Professional Audiobook Creation Tool</p>
         </div>
     </div>
-    """, unsafe_allow_html=True)
+    """
+
+def render_header():
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
+
+API_KEY_SETUP_HTML = """
+    <div style="background: rgba(59, 130, 246, 0.1); border: 1px solid rgba(59, 130, 246, 0.3); border-radius: 0.5rem; padding: 1rem; margin: 1rem 0;">
+        <h4>📋 Setup Instructions:</h4>
+        <ol>
+            <li><strong>Google Gemini API (Required):</strong>
+                <ul>
+                    <li>Go to <a href="https://makersuite.google.com/app/apikey" target="_blank">Google AI Studio</a></li>
+                    <li>Create a new API key</li>
+                    <li>Copy the key</li>
+                </ul>
+            </li>
+            <li><strong>Configure:</strong>
+                <ul>
+                    <li>Open <code>api_keys.txt</code> in your project folder</li>
+                    <li>Paste your Gemini key in the format: <code>GEMINI_API_KEY=your_key_here</code></li>
+                    <li>Save the file and refresh this page</li>
+                </ul>
+            </li>
+        </ol>
+    </div>
+    """
 
 def check_api_keys():
     gemini_key = read_api_keys()
     if not gemini_key:
         st.error("🔑 Gemini API Key Required")
-        st.markdown("""
-        <div style="background: rgba(59, 130, 246, 0.1); border: 1px solid rgba(59, 130, 246, 0.3); border-radius: 0.5rem; padding: 1rem; margin: 1rem 0;">
-            <h4>📋 Setup Instructions:</h4>
-            <ol>
-                <li><strong>Google Gemini API (Required):</strong>
-                    <ul>
-                        <li>Go to <a href="https://makersuite.google.com/app/apikey" target="_blank">Google AI Studio</a></li>
-                        <li>Create a new API key</li>
-                        <li>Copy the key</li>
-                    </ul>
-                </li>
-                <li><strong>Configure:</strong>
-                    <ul>
-                        <li>Open <code>api_keys.txt</code> in your project folder</li>
-                        <li>Paste your Gemini key in the format: <code>GEMINI_API_KEY=your_key_here</code></li>
-                        <li>Save the file and refresh this page</li>
-                    </ul>
-                </li>
-            </ol>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(API_KEY_SETUP_HTML, unsafe_allow_html=True)
         return False
     
-    st.info("✅ **Available Services:** 🎤 Real Speech Audio (pyttsx3), 🤖 Gemini AI Text Enhancement")
+    services = start_services()
+    backend = services.result().name if services.done() and services.exception() is None else "starting up..."
+    st.info(f"✅ **Available Services:** 🎤 Real Speech Audio ({backend}), 🤖 Gemini AI Text Enhancement")
     return True
 
 def render_input_area():
+    """Return the typed text and the uploaded file, if any; uploads are streamed into the pipeline, never decoded here"""
     st.markdown("### 📝 Enter Your Text")
-    text_input = st.text_area("Paste your text here:", height=150, placeholder="Enter the text you want to convert into an audiobook...")
-    uploaded_file = st.file_uploader("Or upload a .txt file:", type=['txt'], help="Upload a text file to automatically load its content")
+    text_input = st.text_area("Paste your text here:", value=st.session_state.get('current_text', ''), height=150, placeholder="Enter the text you want to convert into an audiobook...")
+    uploaded_file = st.file_uploader("Or upload a manuscript:", type=UPLOAD_TYPES, help="Upload a .txt, .md or .epub file; it is read paragraph by paragraph and takes priority over the text box")
     if uploaded_file is not None:
-        try:
-            content = uploaded_file.read().decode('utf-8')
-            text_input = content
-        except Exception as e:
-            st.error(f"Error reading file: {e}")
-    return text_input
+        st.caption(f"📄 {uploaded_file.name} ({uploaded_file.size / 1024:.0f} KB) will be narrated")
+    return text_input, uploaded_file
 
 def render_controls():
     col1, col2 = st.columns(2)
     with col1:
-        tone = st.selectbox("🎭 Select Tone:", options=list(Tone), format_func=lambda x: x.value, help="Choose the emotional tone for your audiobook")
+        tones = list(Tone)
+        tone = st.selectbox("🎭 Select Tone:", options=tones, index=tones.index(st.session_state.get('current_tone', tones[0])), format_func=lambda x: x.value, help="Choose the emotional tone for your audiobook")
     with col2:
-        voice = st.selectbox("🎤 Select Voice:", options=list(Voice), format_func=lambda x: x.value, help="Choose between male or female voice")
-    return tone, voice
+        voices = list(Voice)
+        voice = st.selectbox("🎤 Select Voice:", options=voices, index=voices.index(st.session_state.get('current_voice', voices[0])), format_func=lambda x: x.value, help="Choose between male or female voice")
+    dialogue = st.checkbox("🗣️ Give each character their own voice", value=st.session_state.get('current_dialogue', False), help="Quoted speech is read in a voice chosen for each named speaker; the selected voice narrates the rest")
+    return tone, voice, dialogue
 
 def render_book_style_text(text: str, text_id: str, title: str):
     st.markdown(f"""
@@ -480,221 +3130,420 @@ def render_book_style_text(text: str, text_id: str, title: str):
     </div>
     """, unsafe_allow_html=True)
 
-def render_advanced_audio_player(audio_bytes: bytes, rewritten_text: str):
-    if not audio_bytes:
+def render_advanced_audio_player(audio_key: str, rewritten_text: str, timings: dict = None):
+    if not audio_key:
+        return
+    # Evicted audio comes back from the history store when a session saved it
+    if not get_history_store().restore_audio(audio_key):
+        st.warning("⚠️ This narration's audio has expired from the cache. Please generate it again.")
         return
     st.markdown("### 🎧 Audio Player")
     
-    col1, col2, col3 = st.columns([2, 1, 1])
-    with col1:
-        volume = st.slider("🔊 Volume", 0.0, 1.0, 0.8, 0.1, key="volume_control")
-    with col2:
-        speed = st.slider("⚡ Speed", 0.5, 2.0, 1.0, 0.1, key="speed_control")
-    with col3:
-        st.download_button(label="📥 Download Audio", data=audio_bytes, file_name=f"echoverse_narration_{datetime.now().strftime('%Y%m%d_%H%M%S')}.wav", mime="audio/wav", use_container_width=True)
+    encoder = get_audio_encoder()
+    # A form, so dragging a slider doesn't re-render the audio until the listener applies it
+    with st.form("audio_effects"):
+        col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+        with col1:
+            volume = st.slider("🔊 Volume", 0.0, 1.5, 1.0, 0.1, key="volume_control")
+        with col2:
+            speed = st.slider("⚡ Speed", 0.5, 2.0, 1.0, 0.1, key="speed_control")
+        with col3:
+            default_format = encoder.formats.index(DEFAULT_AUDIO_FORMAT) if DEFAULT_AUDIO_FORMAT in encoder.formats else 0
+            fmt = st.selectbox("💾 Format", options=encoder.formats, index=default_format, format_func=lambda f: AUDIO_FORMATS[f].label, key="audio_format")
+        with col4:
+            normalize = st.checkbox("📏 Normalize", value=True, key="normalize_control")
+            trim_silence = st.checkbox("✂️ Trim silence", value=True, key="trim_control")
+        st.form_submit_button("🎚️ Apply")
     
-    audio_base64 = base64.b64encode(audio_bytes).decode()
+    # Effects are rendered into the file itself, so downloads sound exactly like playback
+    effects = AudioEffects(volume=round(volume, 2), speed=round(speed, 2), normalize=normalize, trim_silence=trim_silence)
+    lead_seconds = 0.0
+    cache = get_audio_cache()
+    # The narration stays in the cache while its derived files are made, even when together they pass the budget
+    with cache.pinned(audio_key):
+        try:
+            audio_key, lead_seconds = AudioProcessor.apply(cache, audio_key, effects)
+        except (OSError, ValueError, wave.Error, ImportError) as e:
+            st.warning(f"⚠️ Could not apply audio effects, playing the original narration: {e}")
+            effects = AudioEffects(normalize=False, trim_silence=False)
+        try:
+            audio_path = encoder.transcode(cache, audio_key, fmt)
+        except (OSError, RuntimeError) as e:
+            st.warning(f"⚠️ Could not encode {fmt.upper()}, serving WAV instead: {e}")
+            fmt = "wav"
+            audio_path = cache.path_for(audio_key)
+    audio_format = AUDIO_FORMATS[fmt]
     
-    st.markdown(f"""
+    try:
+        audio_url = media_url(audio_path, audio_format.mime_type, "player")
+    except ValueError as e:
+        st.warning(f"⚠️ {e}. Pick a compressed format, or set ECHOVERSE_MEDIA_URL to stream audio from disk.")
+        return
+    if audio_url is None:
+        st.audio(audio_path, format=audio_format.mime_type)
+        return
+    file_name = f"echoverse_narration_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{audio_format.extension}"
+    media_server = get_media_server()
+    # Same-origin links honour the download attribute; the media server sets Content-Disposition instead
+    download_url = media_server.url_for('audio', os.path.basename(audio_path), download_name=file_name) if media_server else audio_url
+    st.markdown(f'<a class="download-link" href="{download_url}" download="{file_name}">📥 Download Audio</a>', unsafe_allow_html=True)
+    
+    # Inline JSON must not close the script tag early
+    text_json = json.dumps(rewritten_text).replace('</', '<\\/')
+    timings_json = json.dumps(timings, separators=(',', ':'))
+    player_html = f"""
+    <style>
+    body {{ margin: 0; font-family: 'Georgia', serif; }}
+    .audio-player-container {{
+        background: rgba(15, 23, 42, 0.95);
+        border-radius: 1.5rem;
+        padding: 1rem 2rem;
+        border: 2px solid rgba(148, 163, 184, 0.3);
+        margin-bottom: 1rem;
+    }}
+    .book-text {{
+        font-size: 1.1rem;
+        line-height: 1.8;
+        color: #2c3e50;
+        text-align: justify;
+        white-space: pre-wrap;
+        padding: 1.5rem;
+        background: white;
+        border-radius: 0.8rem;
+        box-shadow: inset 0 2px 8px rgba(0,0,0,0.1);
+        position: relative;
+        max-height: {PLAYER_TEXT_HEIGHT}px;
+        overflow-y: auto;
+    }}
+    .highlight-word {{
+        background: linear-gradient(120deg, #667eea 0%, #764ba2 100%);
+        color: white;
+        border-radius: 4px;
+    }}
+    </style>
     <div class="audio-player-container">
-        <audio controls style="width: 100%; margin-bottom: 1rem;" id="main-audio">
-            <source src="data:audio/wav;base64,{audio_base64}" type="audio/wav">
+        <audio controls preload="metadata" style="width: 100%;" id="main-audio">
+            <source src="{audio_url}" type="{audio_format.mime_type}">
             Your browser does not support the audio element.
         </audio>
     </div>
-    
+    <div class="book-text" id="rewritten_text"></div>
+
     <script>
-    // Text highlighting functionality
-    function highlightText(textId, audioElement) {{
-        const textElement = document.getElementById(textId);
-        if (!textElement || !audioElement) return;
-        
-        const words = textElement.textContent.split(' ');
-        
-        // Wrap each word in a span
-        textElement.innerHTML = words.map(word => 
-            `<span class="word" data-word="${{word}}">${{word}}</span>`
-        ).join(' ');
-        
-        // Get all word spans
-        const wordSpans = textElement.querySelectorAll('.word');
-        
-        // Calculate timing for each word (rough estimation)
-        const duration = audioElement.duration || 10; // fallback duration
-        const wordDuration = duration / words.length;
-        
-        let currentWordIndex = 0;
-        let highlightInterval = null;
-        
-        // Reset highlighting
-        function resetHighlight() {{
-            wordSpans.forEach(span => {{
-                span.classList.remove('highlight-word');
-            }});
-            currentWordIndex = 0;
-            if (highlightInterval) {{
-                clearInterval(highlightInterval);
-                highlightInterval = null;
-            }}
-        }}
-        
-        // Highlight current word
-        function highlightCurrentWord() {{
-            if (currentWordIndex < wordSpans.length) {{
-                // Remove previous highlight
-                if (currentWordIndex > 0) {{
-                    wordSpans[currentWordIndex - 1].classList.remove('highlight-word');
-                }}
-                
-                // Add current highlight
-                wordSpans[currentWordIndex].classList.add('highlight-word');
-                
-                // Scroll to current word
-                wordSpans[currentWordIndex].scrollIntoView({{
-                    behavior: 'smooth',
-                    block: 'center'
-                }});
-                
-                currentWordIndex++;
-            }}
+    const text = {text_json};
+    const timings = {timings_json};
+    const audio = document.getElementById('main-audio');
+    const container = document.getElementById('rewritten_text');
+    const positionKey = 'echoverse-position-{audio_key}';
+    // The timing map is for the raw narration; shift it past trimmed silence and scale it by the rendered speed
+    const leadMs = {lead_seconds * 1000:.1f};
+    const speed = {effects.speed};
+
+    // Wrap each word in a span once; whitespace stays as plain text nodes
+    const spans = [];
+    const fragment = document.createDocumentFragment();
+    for (const part of text.split(/(\\s+)/)) {{
+        if (!part) continue;
+        if (/^\\s+$/.test(part)) {{
+            fragment.appendChild(document.createTextNode(part));
+            continue;
         }}
-        
-        // Event listeners
-        audioElement.addEventListener('play', () => {{
-            resetHighlight();
-            highlightInterval = setInterval(highlightCurrentWord, wordDuration * 1000);
-        }});
-        
-        audioElement.addEventListener('pause', () => {{
-            if (highlightInterval) {{
-                clearInterval(highlightInterval);
-                highlightInterval = null;
-            }}
-        }});
-        
-        audioElement.addEventListener('ended', () => {{
-            resetHighlight();
-        }});
-        
-        audioElement.addEventListener('seeked', () => {{
-            const seekTime = audioElement.currentTime;
-            const newIndex = Math.floor((seekTime / duration) * words.length);
-            currentWordIndex = Math.max(0, Math.min(newIndex, words.length - 1));
-            resetHighlight();
-            for (let i = 0; i < currentWordIndex; i++) {{
-                wordSpans[i].classList.add('highlight-word');
-            }}
+        const span = document.createElement('span');
+        span.textContent = part;
+        spans.push(span);
+        fragment.appendChild(span);
+    }}
+    container.appendChild(fragment);
+
+    // Word start times in ms, from the synthesis timing map when there is one
+    let starts = timings ? timings.words.map(ms => Math.max(0, (ms - leadMs) / speed)) : null;
+    let sentenceStarts = timings ? timings.sentences : null;
+    if (!sentenceStarts) {{
+        sentenceStarts = [0];
+        spans.forEach((span, i) => {{
+            if (/[.!?…]["')\\]]*$/.test(span.textContent) && i + 1 < spans.length) sentenceStarts.push(i + 1);
         }});
     }}
-    
-    // Enhanced audio controls and highlighting
-    document.addEventListener('DOMContentLoaded', function() {{
-        const audio = document.getElementById('main-audio');
-        if (audio) {{
-            // Set initial volume and speed
-            audio.volume = {volume};
-            audio.playbackRate = {speed};
-            
-            // Update volume when slider changes
-            const volumeSlider = document.querySelector('input[aria-label="Volume"]');
-            if (volumeSlider) {{
-                volumeSlider.addEventListener('input', function() {{
-                    audio.volume = parseFloat(this.value);
-                }});
-            }}
-            
-            // Update speed when slider changes
-            const speedSlider = document.querySelector('input[aria-label="Speed"]');
-            if (speedSlider) {{
-                speedSlider.addEventListener('input', function() {{
-                    audio.playbackRate = parseFloat(this.value);
-                }});
+
+    function lastAtOrBefore(values, target) {{
+        let lo = 0, hi = values.length - 1, found = -1;
+        while (lo <= hi) {{
+            const mid = (lo + hi) >> 1;
+            if (values[mid] <= target) {{
+                found = mid;
+                lo = mid + 1;
+            }} else {{
+                hi = mid - 1;
             }}
-            
-            // Initialize highlighting when audio is ready
-            audio.addEventListener('loadedmetadata', () => {{
-                highlightText('rewritten_text', audio);
-            }});
         }}
+        return found;
+    }}
+
+    let currentWord = -1;
+    let currentSentence = -1;
+
+    function keepInView(span) {{
+        // One layout read per sentence, and an instant jump, so long texts never thrash
+        const top = span.offsetTop;
+        if (top < container.scrollTop || top + span.offsetHeight > container.scrollTop + container.clientHeight) {{
+            container.scrollTop = top - container.clientHeight / 3;
+        }}
+    }}
+
+    function sync() {{
+        if (!starts) return;
+        const index = lastAtOrBefore(starts, audio.currentTime * 1000);
+        if (index === currentWord) return;
+        if (currentWord >= 0) spans[currentWord].classList.remove('highlight-word');
+        currentWord = index;
+        if (index < 0) return;
+        spans[index].classList.add('highlight-word');
+        const sentence = lastAtOrBefore(sentenceStarts, index);
+        if (sentence !== currentSentence) {{
+            currentSentence = sentence;
+            keepInView(spans[index]);
+        }}
+    }}
+
+    audio.addEventListener('loadedmetadata', () => {{
+        if (!starts || starts.length !== spans.length) {{
+            // No usable timing map: spread words evenly over the audio
+            const step = audio.duration * 1000 / Math.max(spans.length, 1);
+            starts = spans.map((_, i) => i * step);
+        }}
+        const saved = parseFloat(sessionStorage.getItem(positionKey));
+        if (saved > 0 && saved < audio.duration) audio.currentTime = saved;
+        sync();
+    }});
+    audio.addEventListener('timeupdate', () => {{
+        sync();
+        sessionStorage.setItem(positionKey, audio.currentTime);
+    }});
+    audio.addEventListener('seeked', sync);
+    audio.addEventListener('ended', () => {{
+        if (currentWord >= 0) spans[currentWord].classList.remove('highlight-word');
+        currentWord = currentSentence = -1;
+        sessionStorage.removeItem(positionKey);
     }});
     </script>
-    """, unsafe_allow_html=True)
-    
-    # Add info message using Streamlit components
+    """
+    # Rendered in a component iframe so the highlighting script actually runs
+    components.html(player_html, height=PLAYER_TEXT_HEIGHT + 160)
+
     st.info("🎧 **Your audiobook is ready!** Use the controls above to play and watch the text highlight as you listen.")
-    
-    # Add book-style page layout with rewritten text
-    if rewritten_text:
-        st.markdown("### 📖 Book View")
-        st.markdown(f"""
-        <div class="book-page-container">
-            <div class="book-page">
-                <div class="book-content" id="rewritten_text">
-                    {rewritten_text}
-                </div>
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
 
-def render_audiobook_display(original_text: str, rewritten_text: str, audio_bytes: bytes):
+def render_audiobook_display(original_text: str, rewritten_text: str, audio_key: str, timings: dict = None):
     if not rewritten_text:
         return
     st.markdown("### 📚 Your Audiobook")
     tab1, tab2, tab3 = st.tabs(["📖 Book View", "📝 Text Comparison", "🎧 Audio Player"])
-    with tab1:
-        render_book_style_text(rewritten_text, "rewritten_text", "🎭 Rewritten Text")
-    with tab2:
-        col1, col2 = st.columns(2)
-        with col1:
-            render_book_style_text(original_text, "original_text", "📝 Original Text")
-        with col2:
-            render_book_style_text(rewritten_text, "rewritten_text_compare", "🎭 Rewritten Text")
-    with tab3:
-        render_advanced_audio_player(audio_bytes, rewritten_text)
+    with get_metrics().span("render"):
+        with tab1:
+            render_book_style_text(rewritten_text, "rewritten_text", "🎭 Rewritten Text")
+        with tab2:
+            col1, col2 = st.columns(2)
+            with col1:
+                render_book_style_text(original_text, "original_text", "📝 Original Text")
+            with col2:
+                render_book_style_text(rewritten_text, "rewritten_text_compare", "🎭 Rewritten Text")
+        with tab3:
+            render_advanced_audio_player(audio_key, rewritten_text, timings)
+
+def render_tone_comparison(previews: dict):
+    st.markdown("### 🔀 Tone Comparison")
+    tabs = st.tabs([tone.value for tone in previews])
+    for tab, (tone, text) in zip(tabs, previews.items()):
+        with tab:
+            render_book_style_text(text, f"tone_preview_{tone.name.lower()}", f"🎭 {tone.value}")
+
+def render_rewrite_errors(categories: list):
+    """One message per kind of Gemini failure that made passages fall back to the local rewrite"""
+    for category in dict.fromkeys(categories):
+        message = REWRITE_FALLBACK_MESSAGES.get(category, REWRITE_FALLBACK_MESSAGES["other"])
+        if category == "auth":
+            st.error(message)
+        else:
+            st.warning(message)
+
+LIVE_PLAYER_HTML = """
+<audio id="live-audio" controls preload="auto" style="width: 100%;"></audio>
+<div id="live-status" style="font-family: sans-serif; font-size: 0.85rem; color: #666;"></div>
+<script>
+const audio = document.getElementById('live-audio');
+const statusLine = document.getElementById('live-status');
+let urls = [], current = -1, waiting = false;
+
+function play(index) {{
+    current = index;
+    waiting = false;
+    audio.src = urls[index];
+    if (index > 0) audio.play().catch(() => {{ waiting = true; }});
+}}
+
+function refresh() {{
+    // Each rerun rewrites this element on the page; the player itself is never re-rendered while the job runs
+    const source = window.parent.document.getElementById('echoverse-live-{job_id}');
+    if (source) urls = JSON.parse(source.dataset.urls);
+    if (current < 0 && urls.length) play(0);
+    else if (waiting && current + 1 < urls.length) play(current + 1);
+    statusLine.textContent = current < 0 ? 'Waiting for the first passage...' : `Passage ${{current + 1}} of ${{urls.length}}${{waiting ? ' - waiting for the next one...' : ''}}`;
+}}
+
+audio.addEventListener('ended', () => {{
+    if (current + 1 < urls.length) play(current + 1);
+    else waiting = true;
+    refresh();
+}});
+setInterval(refresh, 500);
+refresh();
+</script>
+"""
+
+def render_live_player(job: Job):
+    """One player for a running job that plays its passages back to back as they finish"""
+    # Listening can't have got further than the time since the first passage was ready
+    reachable = time.time() - job.started - job.first_audio_seconds + LIVE_PLAYER_LOOKAHEAD_SECONDS
+    urls, start = [], 0.0
+    for index, (audio_key, seconds) in enumerate(zip(list(job.segment_keys), list(job.segment_seconds))):
+        if start > reachable:
+            break
+        path = get_audio_cache().path_for(audio_key)
+        try:
+            url = media_url(path, "audio/wav", f"live.{index}")
+        except (OSError, ValueError) as e:
+            print(f"Live passage {index} unavailable: {e}")
+            break
+        if url is None:
+            st.audio(path, format="audio/wav")
+            continue
+        urls.append(url)
+        start += seconds
+    if urls:
+        st.markdown(f'<div id="echoverse-live-{job.id}" data-urls="{html.escape(json.dumps(urls))}" style="display: none;"></div>', unsafe_allow_html=True)
+        components.html(LIVE_PLAYER_HTML.format(job_id=job.id), height=80)
+
+def render_job_status(job_id: str, streaming: bool):
+    """Show progress for a background narration; reruns poll it until it finishes"""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None:
+        st.session_state.active_job_id = None
+        return
+    if job.active:
+        label = "⏳ Waiting for a free narrator..." if job.status == "queued" else f"🎧 Narrated {job.done} of {job.total or '?'} passages"
+        st.progress(job.done / job.total if job.total else 0.0, text=label)
+        if st.button("✖️ Cancel", key=f"cancel_{job.id}"):
+            manager.cancel(job.id)
+            st.rerun()
+        # Fixed place on the page, so warnings appearing below don't make the live player re-render and stop
+        live = st.container()
+        render_rewrite_errors(job.rewrite_errors)
+        if streaming and job.segment_keys:
+            with live:
+                st.markdown("### ⚡ Live Narration")
+                st.caption(f"⏱️ First audio ready in {job.first_audio_seconds:.2f}s")
+                render_live_player(job)
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+    st.session_state.active_job_id = None
+    if job.status == "done":
+        st.session_state.narrations = st.session_state.narrations[-(HISTORY_SESSION_LIMIT - 1):] + [job.history_entry]
+        st.session_state.current_narration = job.narration
+        render_audiobook_display(job.narration.original_text, job.narration.rewritten_text, job.narration.audio_key, job.narration.timings)
+        if job.rewrite_errors:
+            render_rewrite_errors(job.rewrite_errors)
+            st.warning("⚠️ Audiobook generated, but some passages were narrated with the fallback rewrite.")
+        else:
+            st.success("🎉 Audiobook generated successfully!")
+    elif job.status == "failed":
+        st.error(f"Error: {job.error}")
+    elif job.status == "cancelled":
+        st.info("✖️ Narration cancelled.")
 
 def render_history_panel():
     st.sidebar.markdown("### 📚 History")
     if 'narrations' not in st.session_state:
         st.session_state.narrations = []
     if st.session_state.narrations:
-        for i, narration in enumerate(reversed(st.session_state.narrations[-10:])):
-            with st.sidebar.expander(f"📖 {narration.timestamp.strftime('%H:%M')} - {narration.tone.value}"):
-                st.write(f"**Voice:** {narration.voice.value}")
-                st.write(f"**Text:** {narration.original_text[:100]}...")
-                if st.button(f"🔄 Reload", key=f"reload_{i}"):
-                    st.session_state.current_text = narration.original_text
-                    st.session_state.current_tone = narration.tone
-                    st.session_state.current_voice = narration.voice
-                    st.rerun()
+        for entry in reversed(st.session_state.narrations[-10:]):
+            with st.sidebar.expander(f"📖 {entry.timestamp.strftime('%H:%M')} - {entry.tone.value}"):
+                st.write(f"**Voice:** {entry.voice.value}")
+                st.write(f"**Text:** {entry.preview}...")
+                if st.button(f"🔄 Reload", key=f"reload_{entry.id}"):
+                    narration = get_history_store().load(entry.id)
+                    if narration is None:
+                        st.warning("⚠️ This narration is no longer stored.")
+                    else:
+                        if not narration.upload:
+                            # Only the opening of an upload is kept, so the text box stays as it is
+                            st.session_state.current_text = narration.original_text
+                        st.session_state.current_tone = narration.tone
+                        st.session_state.current_voice = narration.voice
+                        st.session_state.current_dialogue = narration.dialogue
+                        st.session_state.current_narration = narration
+                        st.rerun()
     else:
         st.sidebar.info("No history yet. Create your first audiobook!")
+    stats = get_audio_cache().stats()
+    st.sidebar.caption(f"⚡ Audio cache: {stats['hits']} hits · {stats['misses']} misses · {stats['bytes'] / 1048576:.1f} MB")
+    stats = get_rewrite_cache().stats()
+    st.sidebar.caption(f"🧠 Rewrite cache: {stats['hits']} hits · {stats['misses']} misses · {stats['coalesced']} shared")
 
 def main():
     render_header()
+    start_services()
     if not check_api_keys():
         return
     if 'narrations' not in st.session_state:
         st.session_state.narrations = []
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
     render_history_panel()
-    original_text = render_input_area()
-    tone, voice = render_controls()
-    if st.button("🎭 Generate Audiobook", type="primary", use_container_width=True):
-        if not original_text.strip():
+    original_text, uploaded_file = render_input_area()
+    tone, voice, dialogue = render_controls()
+    streaming = st.checkbox("⚡ Stream audio while it is being generated", value=True, help="Start listening to the first passage while the rest is still being narrated")
+    first_chunk_chars = STREAM_FIRST_CHUNK_CHARS if streaming else None
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        generate = st.button("🎭 Generate Audiobook", type="primary", use_container_width=True)
+    with col2:
+        compare = st.button("🔀 Compare Tones", use_container_width=True, help="Rewrite the text in every tone at once; narrating any of them afterwards reuses the rewrite")
+    source_id = f"upload:{uploaded_file.name}:{uploaded_file.size}" if uploaded_file is not None else original_text
+    if generate:
+        if not source_id.strip():
             st.error("Please enter some text to generate an audiobook.")
         else:
-            with st.spinner("🎭 Rewriting text and generating audio..."):
-                try:
-                    rewritten_text = GeminiService.rewrite_text_with_tone(original_text, tone)
-                    audio_bytes = TTSService.generate_audio(rewritten_text, voice)
-                    if rewritten_text and audio_bytes:
-                        narration = Narration(id=datetime.now().strftime('%Y%m%d_%H%M%S'), original_text=original_text, rewritten_text=rewritten_text, tone=tone, voice=voice, timestamp=datetime.now(), audio_bytes=audio_bytes)
-                        st.session_state.narrations.append(narration)
-                        render_audiobook_display(original_text, rewritten_text, audio_bytes)
-                        st.success("🎉 Audiobook generated successfully!")
-                    else:
-                        st.error("Failed to generate audiobook. Please try again.")
-                except Exception as e:
-                    st.error(f"Error: {e}")
+            try:
+                paragraphs = upload = None
+                if uploaded_file is not None:
+                    # The job thread reads the upload lazily; each rerun gets its own file object, so nothing else moves its position
+                    uploaded_file.seek(0)
+                    paragraphs = ingest_paragraphs(uploaded_file, uploaded_file.name)
+                    original_text, upload = "", uploaded_file.name
+                st.session_state.active_job_id = get_job_manager().submit(st.session_state.session_id, original_text, tone, voice, first_chunk_chars,
+                                                                          previous=st.session_state.get('current_narration'), paragraphs=paragraphs, upload=upload, dialogue=dialogue)
+                st.session_state.current_narration = None
+            except RuntimeError as e:
+                st.warning(f"⚠️ {e}")
+    if compare:
+        if not source_id.strip():
+            st.error("Please enter some text to compare tones.")
+        else:
+            if uploaded_file is not None:
+                # Only the opening of an upload is compared
+                uploaded_file.seek(0)
+                original_text = leading_paragraphs(ingest_paragraphs(uploaded_file, uploaded_file.name))
+            rewrite_errors = []
+            with st.spinner("🔀 Rewriting in every tone..."):
+                st.session_state.tone_previews = (source_id, NarrationPipeline.preview_tones(original_text, list(Tone), first_chunk_chars, rewrite_errors.append))
+            render_rewrite_errors(rewrite_errors)
+    if st.session_state.get('tone_previews') and st.session_state.tone_previews[0] == source_id:
+        render_tone_comparison(st.session_state.tone_previews[1])
+    if st.session_state.get('active_job_id'):
+        render_job_status(st.session_state.active_job_id, streaming)
+    elif st.session_state.get('current_narration'):
+        narration = st.session_state.current_narration
+        render_audiobook_display(narration.original_text, narration.rewritten_text, narration.audio_key, narration.timings)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,188 @@
+"""EchoVerse Pro headless batch runner
+
+Narrates every manuscript listed in a manifest without the Streamlit UI.
+Inputs may be .txt, .md or .epub files in any common encoding.
+
+    python batch.py manifest.json --output-dir audiobooks --workers 4
+
+The manifest is JSON:
+
+    {
+        "defaults": {"tone": "Calm", "voice": "Female Alto", "format": "mp3"},
+        "jobs": [
+            {"input": "chapters/01.txt"},
+            {"id": "prologue", "input": "chapters/00.txt", "tone": "Dramatic"},
+            {"input": "chapters/02.txt", "dialogue": true}
+        ]
+    }
+
+"dialogue": true reads quoted speech in a voice per named speaker.
+
+Finished jobs are appended to <output-dir>/checkpoint.jsonl, so an interrupted
+run picks up where it stopped. A summary with per-job timings is written to
+<output-dir>/summary.json.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# Same default as the app's ECHOVERSE_GEMINI_RPM
+DEFAULT_GEMINI_RPM = 15
+
+
+def load_manifest(path: str) -> list:
+    """Jobs with defaults filled in; unknown tones, voices and formats are rejected before anything runs"""
+    import app
+
+    choices = {
+        "tone": [tone.value for tone in app.Tone],
+        "voice": [voice.value for voice in app.Voice],
+        "format": app.get_audio_encoder().formats,
+    }
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    seen = set()
+    for entry in manifest["jobs"]:
+        job = {**defaults, **entry}
+        job["input"] = os.path.join(base_dir, job["input"])
+        job.setdefault("id", os.path.splitext(os.path.basename(job["input"]))[0])
+        job.setdefault("tone", "Calm")
+        job.setdefault("voice", "Male Medium")
+        job.setdefault("format", "wav")
+        job.setdefault("dialogue", False)
+        if job["id"] in seen:
+            raise ValueError(f"Duplicate job id in manifest: {job['id']}")
+        for field, allowed in choices.items():
+            if job[field] not in allowed:
+                raise ValueError(f"Job {job['id']}: unsupported {field} {job[field]!r}, expected one of {', '.join(allowed)}")
+        seen.add(job["id"])
+        jobs.append(job)
+    return jobs
+
+
+def load_checkpoint(path: str) -> dict:
+    done = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    if record.get("status") == "ok":
+                        done[record["id"]] = record
+    return done
+
+
+def run_job(job: dict, output_dir: str) -> dict:
+    """Runs in a worker process: rewrite, narrate and encode one manuscript"""
+    import app
+
+    started = time.perf_counter()
+    record = {"id": job["id"], "input": job["input"], "tone": job["tone"], "voice": job["voice"], "format": job["format"]}
+    try:
+        with open(job["input"], 'rb') as f:
+            text = "\n\n".join(app.ingest_paragraphs(f, job["input"]))
+        tone, voice = app.Tone(job["tone"]), app.Voice(job["voice"])
+        rewritten_text, audio_key = app.NarrationPipeline.run(text, tone, voice, priority=app.RewritePriority.BATCH, dialogue=job["dialogue"])
+        generated = time.perf_counter()
+        if not audio_key:
+            raise RuntimeError("no audio was produced")
+
+        cache = app.get_audio_cache()
+        audio_format = app.AUDIO_FORMATS[job["format"]]
+        output_path = os.path.join(output_dir, f"{job['id']}.{audio_format.extension}")
+        temp_path = output_path + ".part"
+        shutil.copyfile(app.get_audio_encoder().transcode(cache, audio_key, job["format"]), temp_path)
+        os.replace(temp_path, output_path)
+        with open(os.path.join(output_dir, f"{job['id']}.txt"), 'w', encoding='utf-8') as f:
+            f.write(rewritten_text)
+
+        elapsed = time.perf_counter() - started
+        (channels, sample_width, rate), _, data_size = app.wav_layout(cache.path_for(audio_key))
+        audio_seconds = data_size / (channels * sample_width * rate)
+        record.update({
+            "status": "ok",
+            "output": output_path,
+            "chars": len(text),
+            "audio_seconds": round(audio_seconds, 2),
+            "generate_seconds": round(generated - started, 3),
+            "encode_seconds": round(elapsed - (generated - started), 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "chars_per_second": round(len(text) / elapsed, 1) if elapsed else None,
+        })
+    except Exception as e:
+        record.update({"status": "error", "error": str(e), "elapsed_seconds": round(time.perf_counter() - started, 3)})
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate audiobooks for every manuscript in a manifest")
+    parser.add_argument("manifest", help="JSON manifest of jobs")
+    parser.add_argument("--output-dir", default="audiobooks", help="Where audio, checkpoint and summary are written")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Worker processes")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and redo every job")
+    parser.add_argument("--gemini-rpm", type=float, default=float(os.environ.get('ECHOVERSE_GEMINI_RPM', DEFAULT_GEMINI_RPM)),
+                        help="Gemini requests per minute for the whole run, split across workers")
+    args = parser.parse_args(argv)
+
+    # Each worker process has its own limiter, so give each one a share of the quota
+    os.environ['ECHOVERSE_GEMINI_RPM'] = str(args.gemini_rpm / args.workers)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = load_manifest(args.manifest)
+    checkpoint_path = os.path.join(args.output_dir, "checkpoint.jsonl")
+    if args.restart and os.path.exists(checkpoint_path):
+        os.unlink(checkpoint_path)
+    done = load_checkpoint(checkpoint_path)
+    pending = [job for job in jobs if job["id"] not in done]
+    print(f"📚 {len(jobs)} jobs, {len(done)} already done, {len(pending)} to run on {args.workers} workers")
+
+    started = time.perf_counter()
+    records = dict(done)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+        futures = {executor.submit(run_job, job, args.output_dir): job for job in pending}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory); its job and any still queued are recorded as failed
+                job = futures[future]
+                record = {"id": job["id"], "input": job["input"], "status": "error", "error": f"worker process crashed: {e}"}
+            records[record["id"]] = record
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            if record["status"] == "ok":
+                print(f"✅ {record['id']}: {record['chars']} chars in {record['elapsed_seconds']}s ({record['chars_per_second']} chars/s)")
+            else:
+                print(f"❌ {record['id']}: {record['error']}")
+    wall_seconds = time.perf_counter() - started
+
+    ordered = [records[job["id"]] for job in jobs if job["id"] in records]
+    succeeded = [r for r in ordered if r["status"] == "ok"]
+    run_chars = sum(r["chars"] for r in succeeded if r["id"] not in done)
+    summary = {
+        "jobs": ordered,
+        "total_jobs": len(jobs),
+        "succeeded": len(succeeded),
+        "failed": len(ordered) - len(succeeded),
+        "workers": args.workers,
+        "wall_seconds": round(wall_seconds, 3),
+        "chars_this_run": run_chars,
+        "chars_per_second": round(run_chars / wall_seconds, 1) if wall_seconds and run_chars else None,
+    }
+    with open(os.path.join(args.output_dir, "summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    print(f"📊 {summary['succeeded']}/{summary['total_jobs']} succeeded in {summary['wall_seconds']}s, summary written to {args.output_dir}/summary.json")
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
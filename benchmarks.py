@@ -0,0 +1,369 @@
+"""EchoVerse Pro benchmarks
+
+Times each stage of rewrite -> synthesize -> render with a local stand-in for
+the Gemini API, so runs are reproducible and cost no quota.
+
+    python benchmarks.py                          # all stages, all sizes
+    python benchmarks.py --sizes sentence page    # a subset
+    python benchmarks.py --save baseline.json     # record a baseline
+    python benchmarks.py --compare baseline.json  # flag regressions against it
+    python benchmarks.py --legacy-fallback        # old vs new fallback synthesizer
+    python benchmarks.py --startup                # cold import and per-rerun overhead
+    python benchmarks.py --normalize              # speech normalizer vs sequential regex passes
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import re
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+
+# Keep benchmark caches away from the app's real ones; each run starts cold
+os.environ.setdefault('ECHOVERSE_CACHE_DIR', tempfile.mkdtemp(prefix='echoverse_bench_'))
+
+import app
+from app import TTSService, Tone, Voice
+
+
+def legacy_speech_fallback(text: str, voice: Voice) -> bytes:
+    # Reference copy of the original per-sample loop, kept for comparison
+    sample_rate = 22050
+    duration = min(len(text) * 0.1, 8)
+    fallback_freqs = {
+        Voice.MALE_DEEP: 80,
+        Voice.MALE_MEDIUM: 110,
+        Voice.MALE_YOUNG: 140,
+        Voice.FEMALE_SOPRANO: 210,
+        Voice.FEMALE_ALTO: 170,
+        Voice.FEMALE_MATURE: 150
+    }
+    base_freq = fallback_freqs.get(voice, 120)
+    samples = []
+    for i in range(int(sample_rate * duration)):
+        char_index = i % len(text) if text else 0
+        frequency = base_freq + (ord(text[char_index]) % 50)
+        envelope = 0.3 * math.sin(math.pi * i / (sample_rate * duration))
+        sample = int(32767 * envelope * math.sin(2 * math.pi * frequency * i / sample_rate))
+        samples.append(sample)
+    audio_data = struct.pack('<' + 'h' * len(samples), *samples)
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(22050)
+        wav_file.writeframes(audio_data)
+    wav_buffer.seek(0)
+    return wav_buffer.read()
+
+
+def best_of(fn, *args, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def bench_speech_fallback():
+    print("🎵 create_speech_fallback")
+    cases = [
+        ("one sentence", "The night was quiet."),
+        ("paragraph", "The night was quiet and the wind moved through the trees. " * 4),
+        ("max duration", "A long chapter of text. " * 200),
+    ]
+    for label, text in cases:
+        for voice in (Voice.MALE_DEEP, Voice.FEMALE_SOPRANO):
+            legacy_time, legacy_bytes = best_of(legacy_speech_fallback, text, voice)
+            new_time, new_bytes = best_of(TTSService.create_speech_fallback, text, voice)
+            if new_bytes != legacy_bytes:
+                raise AssertionError(f"Output mismatch for {label} / {voice.value}")
+            print(f"  {label:<14} {voice.value:<15} legacy {legacy_time * 1000:8.1f} ms"
+                  f"  new {new_time * 1000:8.1f} ms  speedup {legacy_time / new_time:5.2f}x")
+
+
+def bench_startup(repeat: int):
+    """Cold import of app in a fresh interpreter, and the fixed cost every Streamlit rerun pays"""
+    print("🚀 Startup")
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def interpreter(code: str) -> float:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=here, check=True, capture_output=True)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+
+    cold_ms = (interpreter("import app") - interpreter("pass")) * 1000
+    print(f"  {'cold import':<16} {cold_ms:10.1f} ms")
+    app.start_services().result()
+    for label, fn in (("read_api_keys", app.read_api_keys), ("rerun chrome", lambda: (app.render_header(), app.check_api_keys()))):
+        calls = 1000
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        print(f"  {label:<16} {(time.perf_counter() - started) / calls * 1e6:10.1f} us per call")
+
+
+def naive_normalize(text: str) -> str:
+    # Reference: one re.sub pass over the whole text per rule and per lexicon entry, nothing memoized
+    for kind, pattern in app.SPOKEN_FORM_RULES:
+        if kind == "abbreviation":
+            patterns = [r'(?<![\w.])' + re.escape(word) for word in app.ABBREVIATIONS]
+        elif kind == "pronunciation":
+            patterns = [r'(?<!\w)' + re.escape(word) + r'(?!\w)' for word in app.PRONUNCIATIONS]
+        else:
+            patterns = [pattern]
+        for rule in patterns:
+            text = re.sub(rule, lambda match: app.spoken_form(match, kind), text)
+    return text
+
+
+NORMALIZE_SAMPLES = ("Dr. Smith paid $1,250.50 on Jan. 3rd, 1999 at 10:05.", "Mr. and Mrs. Jones own 45% of the firm & its AI.",
+                     "The **old** house had 112 rooms, e.g. a library.", "It cost €0.99, approx. 3.5 times less than in 2024.")
+
+
+def normalize_text(chars: int, seed: int = 1510) -> str:
+    rng = random.Random(seed)
+    fallback = app.GeminiService.simple_rewrite_fallback("", Tone.DRAMATIC)
+    sentences, length = [fallback], len(fallback)
+    while length < chars:
+        sentence = rng.choice(NORMALIZE_SAMPLES) if rng.random() < 0.5 else sample_text(rng.randint(60, 200), rng.random())
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def bench_normalize(repeat: int):
+    print("🗣️ normalize_for_speech")
+    for label, chars in (("1 KB", 1000), ("100 KB", 100000), ("1 MB", 1000000)):
+        text = normalize_text(chars)
+        naive_time, naive_text = best_of(naive_normalize, text, repeat=repeat)
+
+        def cold(text):
+            app.normalize_sentence.cache_clear()
+            return app.normalize_for_speech(text)
+
+        new_time, new_text = best_of(cold, text, repeat=repeat)
+        if new_text != naive_text:
+            raise AssertionError(f"Output mismatch for {label}")
+        warm_time, _ = best_of(app.normalize_for_speech, text, repeat=repeat)
+        print(f"  {label:<7} naive {naive_time * 1000:9.1f} ms  combined {new_time * 1000:9.1f} ms ({len(text) / new_time / 1e6:5.2f} MB/s)"
+              f"  memoized {warm_time * 1000:8.1f} ms  speedup {naive_time / new_time:5.2f}x")
+
+
+WORDS = ("the night wind carried whispers across silent hills while lanterns flickered in distant windows "
+         "and old stories waited patiently for someone brave enough to read them aloud").split()
+
+# Input sizes in characters, from one sentence to a full book
+SIZES = {
+    "sentence": 80,
+    "paragraph": 600,
+    "page": 3000,
+    "chapter": 30000,
+    "book": 300000,
+}
+
+
+def sample_text(chars: int, seed: int = 1510) -> str:
+    rng = random.Random(seed)
+    sentences, length = [], 0
+    while length < chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+        sentences.append(sentence)
+        length += len(sentence) + 1
+        if rng.random() < 0.15:
+            sentences.append("\n\n")
+    return " ".join(sentences)[:chars]
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+STUB_REQUESTS_PER_MINUTE = 1e9
+STUB_BURST = 1000
+
+
+class StubGenerativeModel:
+    """Answers like Gemini would, after a fixed simulated network latency"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, prompt, generation_config=None):
+        time.sleep(self.latency)
+        instructions, body = prompt.split("\n\n", 1)
+        if instructions == app.REWRITE_BATCH_PROMPT:
+            return StubResponse(json.dumps({item["id"]: item["text"] for item in json.loads(body)}))
+        return StubResponse(body)
+
+
+def install_gemini_stub(latency: float):
+    app.read_api_keys = lambda: "benchmark-key"
+    app.get_gemini_model = lambda api_key: StubGenerativeModel(latency)
+    # The stub has no quota, so the pipeline is timed rather than the production request rate
+    limiter = app.GeminiRateLimiter(STUB_REQUESTS_PER_MINUTE, STUB_BURST, app.GEMINI_MAX_RETRIES, app.GEMINI_MAX_WAIT_SECONDS,
+                                    app.GEMINI_BREAKER_THRESHOLD, app.GEMINI_BREAKER_COOLDOWN_SECONDS)
+    app.get_gemini_limiter = lambda: limiter
+
+
+STAGES = ["rewrite", "synthesize", "fallback", "render", "pipeline", "pipeline_cached", "compare_tones"]
+
+
+def cold_pipeline(text: str):
+    """Full pipeline against empty caches, so every chunk really is rewritten and synthesized"""
+    directory = tempfile.mkdtemp(dir=os.environ['ECHOVERSE_CACHE_DIR'])
+    rewrite_cache = app.RewriteCache(os.path.join(directory, 'rewrites.sqlite3'), app.REWRITE_CACHE_TTL_SECONDS, app.REWRITE_CACHE_MAX_ENTRIES)
+    audio_cache = app.AudioCache(os.path.join(directory, 'audio'), app.AUDIO_CACHE_MAX_BYTES)
+    app.get_rewrite_cache = lambda: rewrite_cache
+    app.get_audio_cache = lambda: audio_cache
+    return app.NarrationPipeline.run(text, Tone.CALM, Voice.MALE_MEDIUM)
+
+
+def cold_compare_tones(text: str):
+    """Every tone for every chunk through batched rewrites, against an empty rewrite cache"""
+    directory = tempfile.mkdtemp(dir=os.environ['ECHOVERSE_CACHE_DIR'])
+    rewrite_cache = app.RewriteCache(os.path.join(directory, 'rewrites.sqlite3'), app.REWRITE_CACHE_TTL_SECONDS, app.REWRITE_CACHE_MAX_ENTRIES)
+    app.get_rewrite_cache = lambda: rewrite_cache
+    return app.NarrationPipeline.preview_tones(text, list(Tone))
+
+
+def stage_functions():
+    backend = app.get_tts_backend()
+    return {
+        # Uncached single call, the cost every cache miss pays
+        "rewrite": lambda text: app.GeminiService.generate_rewrite(text, Tone.CALM, "benchmark-key"),
+        "synthesize": lambda text: backend.synthesize(text, Voice.MALE_MEDIUM),
+        "fallback": lambda text: TTSService.create_speech_fallback(text, Voice.MALE_MEDIUM),
+        "render": lambda text: app.render_advanced_audio_player(
+            app.get_audio_cache().put_content(TTSService.create_speech_fallback(text, Voice.MALE_MEDIUM)), text),
+        "pipeline": cold_pipeline,
+        # Same text again: every chunk is served from the rewrite and audio caches
+        "pipeline_cached": lambda text: app.NarrationPipeline.run(text, Tone.CALM, Voice.MALE_MEDIUM),
+        "compare_tones": cold_compare_tones,
+    }
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(fn, text: str, repeat: int) -> dict:
+    fn(text)  # warm-up: imports, engine start, first-use caches
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        timings.append(time.perf_counter() - started)
+    # Peak memory on a separate run, since tracing slows everything down
+    tracemalloc.start()
+    fn(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    median = statistics.median(timings)
+    return {
+        "p50_ms": round(median * 1000, 3),
+        "p90_ms": round(percentile(timings, 0.9) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "chars_per_second": round(len(text) / median, 1) if median else None,
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def run_suite(stages: list, sizes: list, repeat: int) -> dict:
+    functions = stage_functions()
+    results = {}
+    for stage in stages:
+        for size in sizes:
+            text = sample_text(SIZES[size])
+            # The whole pipeline on a full book is slow; fewer repeats keep runs practical
+            runs = max(1, repeat // 5) if stage in ("pipeline", "compare_tones") and SIZES[size] >= 30000 else repeat
+            result = measure(functions[stage], text, runs)
+            results[f"{stage}/{size}"] = result
+            print(f"  {stage:<15} {size:<9} p50 {result['p50_ms']:10.2f} ms  p90 {result['p90_ms']:10.2f} ms"
+                  f"  {result['chars_per_second'] or 0:12.0f} chars/s  peak {result['peak_memory_kb']:10.1f} KB")
+    return results
+
+
+def compare(results: dict, baseline_path: str, threshold: float) -> bool:
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)["results"]
+    regressed = False
+    print(f"📊 Compared with {baseline_path} (regression threshold {threshold:.0%})")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["p50_ms"], result["p50_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  ❌ REGRESSION"
+            regressed = True
+        elif change < -threshold:
+            flag = "  ✅ faster"
+        print(f"  {name:<22} {before:10.2f} ms -> {after:10.2f} ms  {change:+7.1%}{flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the EchoVerse rewrite -> synthesize -> render pipeline")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per stage and size")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Simulated Gemini round trip in seconds")
+    parser.add_argument("--save", help="Write results as a JSON baseline")
+    parser.add_argument("--compare", help="Compare against a saved JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative p50 slowdown that counts as a regression")
+    parser.add_argument("--legacy-fallback", action="store_true", help="Only compare the old and new fallback synthesizers")
+    parser.add_argument("--startup", action="store_true", help="Only measure cold import and per-rerun overhead")
+    parser.add_argument("--normalize", action="store_true", help="Only compare the speech normalizer with sequential regex passes")
+    args = parser.parse_args(argv)
+
+    if args.legacy_fallback:
+        bench_speech_fallback()
+        return 0
+    if args.startup:
+        bench_startup(args.repeat)
+        return 0
+    if args.normalize:
+        bench_normalize(min(args.repeat, 5))
+        return 0
+
+    install_gemini_stub(args.stub_latency)
+    print(f"⏱️ Benchmarking on {platform.python_implementation()} {platform.python_version()}, TTS backend {app.get_tts_backend().name}")
+    results = run_suite(args.stages, args.sizes, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "tts_backend": app.get_tts_backend().name,
+                "stub_latency": args.stub_latency,
+                "repeat": args.repeat,
+                "results": results,
+            }, f, indent=2)
+        print(f"💾 Baseline written to {args.save}")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
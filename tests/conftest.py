@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Keep test caches away from the app's real ones
+os.environ.setdefault('ECHOVERSE_CACHE_DIR', tempfile.mkdtemp(prefix='echoverse_test_'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,23 @@
+import io
+
+from app import INGEST_MAX_PARAGRAPH_CHARS, ingest_paragraphs
+
+
+def test_blank_lines_separate_paragraphs():
+    text = "First  paragraph\nstill first.\n\n\nSecond one.\n \nThird."
+    assert list(ingest_paragraphs(io.BytesIO(text.encode()), "book.txt")) == ["First paragraph still first.", "Second one.", "Third."]
+
+
+def test_text_without_blank_lines_is_let_go_in_bounded_pieces():
+    lines = [f"Line {i} has a few words in it." for i in range(5000)]
+    paragraphs = list(ingest_paragraphs(io.BytesIO("\n".join(lines).encode()), "book.txt"))
+    assert len(paragraphs) > 1
+    assert max(len(paragraph) for paragraph in paragraphs) <= INGEST_MAX_PARAGRAPH_CHARS
+    assert " ".join(paragraphs) == " ".join(lines)
+
+
+def test_unbroken_text_is_cut_between_words():
+    words = ["word"] * 5000
+    paragraphs = list(ingest_paragraphs(io.BytesIO(" ".join(words).encode()), "book.txt"))
+    assert max(len(paragraph) for paragraph in paragraphs) <= INGEST_MAX_PARAGRAPH_CHARS
+    assert " ".join(paragraphs).split() == words
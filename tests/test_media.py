@@ -0,0 +1,33 @@
+import pytest
+
+from app import content_disposition, parse_byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    (" bytes=0-0 ", (0, 0)),
+])
+def test_parse_byte_range_resolves_against_the_file_size(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100", "bytes=-", "bytes=-0", "bytes=0-1,5-9", "items=0-9"])
+def test_parse_byte_range_rejects_unsatisfiable_ranges(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+def test_parse_byte_range_rejects_empty_files():
+    assert parse_byte_range("bytes=0-", 0) is None
+
+
+def test_content_disposition_accepts_generated_names():
+    assert content_disposition("echoverse_narration_20240101_120000.mp3") == 'attachment; filename="echoverse_narration_20240101_120000.mp3"'
+
+
+@pytest.mark.parametrize("name", ["", "..", "x\r\nSet-Cookie: evil=1", "€.wav", 'a".wav', "../secret.wav", "a" * 200])
+def test_content_disposition_rejects_other_names(name):
+    assert content_disposition(name) is None
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+import app
+from app import GeminiRateLimiter, GeminiThrottled, RewritePriority
+
+
+def make_limiter(requests_per_minute=600, burst=1, max_retries=2, max_wait=5.0, breaker_threshold=5, breaker_cooldown=0.2):
+    return GeminiRateLimiter(requests_per_minute, burst, max_retries, max_wait, breaker_threshold, breaker_cooldown)
+
+
+def test_acquire_serves_waiting_callers_by_priority():
+    limiter = make_limiter(requests_per_minute=120)
+    limiter.acquire(RewritePriority.INTERACTIVE, time.monotonic() + 1)
+    served = []
+
+    def wait(priority):
+        limiter.acquire(priority, time.monotonic() + 5)
+        served.append(priority)
+
+    # Queued lowest priority first; the next token arrives after every caller is waiting
+    threads = [threading.Thread(target=wait, args=(priority,)) for priority in reversed(RewritePriority)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(5)
+    assert served == list(RewritePriority)
+
+
+def test_acquire_gives_up_at_the_deadline():
+    limiter = make_limiter(requests_per_minute=6)
+    limiter.acquire(RewritePriority.INTERACTIVE, time.monotonic() + 1)
+    started = time.monotonic()
+    with pytest.raises(GeminiThrottled, match="Timed out"):
+        limiter.acquire(RewritePriority.FIRST_AUDIO, started + 0.1)
+    assert 0.1 <= time.monotonic() - started < 1
+
+
+def test_open_circuit_admits_one_trial_call():
+    limiter = make_limiter(burst=5, breaker_threshold=1, breaker_cooldown=0.1)
+    limiter.record_throttle()
+    with pytest.raises(GeminiThrottled, match="circuit open"):
+        limiter.acquire(RewritePriority.FIRST_AUDIO, time.monotonic() + 2)
+    time.sleep(0.1)
+    limiter.acquire(RewritePriority.INTERACTIVE, time.monotonic() + 2)
+    with pytest.raises(GeminiThrottled, match="half-open"):
+        limiter.acquire(RewritePriority.FIRST_AUDIO, time.monotonic() + 2)
+    limiter.record_success()
+    limiter.acquire(RewritePriority.INTERACTIVE, time.monotonic() + 2)
+
+
+def test_failed_trial_call_reopens_the_circuit():
+    limiter = make_limiter(burst=5, breaker_threshold=1, breaker_cooldown=0.1)
+    limiter.record_throttle()
+    time.sleep(0.1)
+    limiter.acquire(RewritePriority.INTERACTIVE, time.monotonic() + 2)
+    limiter.record_throttle()
+    with pytest.raises(GeminiThrottled, match="circuit open"):
+        limiter.acquire(RewritePriority.INTERACTIVE, time.monotonic() + 2)
+
+
+def test_call_retries_throttled_errors(monkeypatch):
+    monkeypatch.setattr(app, 'GEMINI_BACKOFF_BASE_SECONDS', 0.001)
+    monkeypatch.setattr(app, 'classify_gemini_error', lambda error: "rate_limit")
+    limiter = make_limiter(burst=5)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise RuntimeError("429 Too Many Requests")
+        return "rewritten"
+
+    assert limiter.call(flaky) == "rewritten"
+    assert len(attempts) == 3
+
+
+def test_call_does_not_retry_other_errors():
+    limiter = make_limiter()
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("unexpected response")
+
+    with pytest.raises(ValueError):
+        limiter.call(broken)
+    assert len(attempts) == 1
+
+
+def test_call_stops_retrying_when_the_backoff_would_pass_the_deadline(monkeypatch):
+    monkeypatch.setattr(app, 'classify_gemini_error', lambda error: "quota")
+    limiter = make_limiter(max_wait=1.0)
+    attempts = []
+
+    def throttled():
+        attempts.append(1)
+        raise RuntimeError("429 quota exceeded, retry in 30s")
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="retry in 30s"):
+        limiter.call(throttled)
+    assert len(attempts) == 1
+    assert time.monotonic() - started < 1
+
+
+def test_resource_exhausted_is_a_quota_error():
+    exceptions = pytest.importorskip("google.api_core.exceptions")
+    assert app.classify_gemini_error(exceptions.ResourceExhausted("Quota exceeded")) == "quota"
+    assert app.classify_gemini_error(exceptions.TooManyRequests("Slow down")) == "rate_limit"
+
+
+def test_unmatched_api_errors_are_other():
+    exceptions = pytest.importorskip("google.api_core.exceptions")
+    assert app.classify_gemini_error(exceptions.BadRequest("invalid request payload")) == "other"
+
+
+@pytest.mark.parametrize("error, category", [
+    (ValueError("Invalid operation: the response was blocked"), "other"),
+    (RuntimeError("429 quota exceeded"), "other"),
+    (ValueError("No API key was provided"), "auth"),
+])
+def test_plain_errors_are_not_classified_by_message(error, category):
+    assert app.classify_gemini_error(error) == category
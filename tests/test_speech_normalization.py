@@ -0,0 +1,51 @@
+import pytest
+
+from app import normalize_for_speech, strip_markdown
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("I scored 5 < 10 and 20 > 15 points.", "I scored five < ten and twenty > fifteen points."),
+    ("See <b>bold</b> text.<br/>", "See bold text."),
+    ("A **very** _quiet_ night 🌙.", "A very  quiet  night ."),
+    ("Read [the guide](https://example.com) first.", "Read the guide first."),
+])
+def test_markup_is_removed_but_comparisons_are_kept(text, expected):
+    assert normalize_for_speech(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("It happened in 1999.", "It happened in nineteen ninety-nine."),
+    ("Back in 2005 and 1905.", "Back in two thousand five and nineteen oh five."),
+    ("The 1990s gave way to the 2000s.", "The nineteen nineties gave way to the two thousands."),
+    ("Through the 1800s and the mid-1980s.", "Through the eighteen hundreds and the mid-nineteen eighties."),
+    ("From 1999-2004.", "From nineteen ninety-nine-two thousand four."),
+])
+def test_standalone_years_are_read_as_years(text, expected):
+    assert normalize_for_speech(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Call 555-1234 now.", "Call five hundred fifty-five-one thousand two hundred thirty-four now."),
+    ("It weighs 1500.5 kg.", "It weighs one thousand five hundred point five kg."),
+    ("We walked 1,999 miles.", "We walked one thousand nine hundred ninety-nine miles."),
+    ("There were 2100 seats.", "There were two thousand one hundred seats."),
+])
+def test_other_numbers_are_not_read_as_years(text, expected):
+    assert normalize_for_speech(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("It cost $1,250.50.", "It cost one thousand two hundred fifty dollars and fifty cents."),
+    ("Only £1 or €0.99.", "Only one pound or ninety-nine cents."),
+    ("Meet at 10:05 or 7:00.", "Meet at ten oh five or seven o'clock."),
+    ("The 3rd and 21st runners.", "The third and twenty-first runners."),
+    ("Nearly 45% agreed.", "Nearly forty-five percent agreed."),
+    ("Dr. Smith met Mrs. Jones, e.g. at noon.", "Doctor Smith met Missus Jones, for example at noon."),
+    ("EchoVerse & AI.", "Echo Verse and A I."),
+])
+def test_spoken_forms(text, expected):
+    assert normalize_for_speech(text) == expected
+
+
+def test_markdown_keeps_comparisons():
+    assert strip_markdown("5 < 10 and <em>20</em> > 15") == "5 < 10 and 20 > 15"